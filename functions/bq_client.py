@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, Optional
+
+from google.api_core.retry import Retry
+from google.cloud import bigquery
+from google.cloud.bigquery.retry import DEFAULT_RETRY
+
+
+_CLIENT_LOCK = threading.Lock()
+_CLIENTS: Dict[Optional[str], bigquery.Client] = {}
+
+# BigQuery API 呼び出しとジョブ完了待ちの再試行ポリシー。
+# バックオフは最大 60 秒で頭打ちにし、全体の締め切り（秒）を必ず設ける。
+DEFAULT_DEADLINE_SECONDS = 600.0
+_BQ_RETRY = DEFAULT_RETRY.with_delay(initial=0.25, maximum=60.0, multiplier=1.5)
+
+
+def _create_client(project_id: Optional[str]) -> bigquery.Client:
+    # 認証は環境変数 GOOGLE_APPLICATION_CREDENTIALS などに依存
+    if project_id:
+        return bigquery.Client(project=project_id)
+    return bigquery.Client()
+
+
+def get_client(project_id: Optional[str] = None) -> bigquery.Client:
+    """
+    project_id ごとに bigquery.Client を使い回す。
+
+    クライアント生成は認証情報の探索や HTTP セッションの初期化を伴い重いため、
+    プロセス内で一度だけ生成し、コネクションプールと認証トークンを再利用する。
+    """
+    # 生成済みならロックを取らずに返す。
+    # Cloud Functions のワーカースレッドから同時に呼ばれても二重生成しないよう、生成だけはロック内で行う
+    client = _CLIENTS.get(project_id)
+    if client is None:
+        with _CLIENT_LOCK:
+            client = _CLIENTS.get(project_id)
+            if client is None:
+                client = _CLIENTS[project_id] = _create_client(project_id)
+    return client
+
+
+def bq_retry(deadline: float = DEFAULT_DEADLINE_SECONDS) -> Retry:
+    """締め切り deadline 秒の再試行ポリシーを返す"""
+    return _BQ_RETRY.with_deadline(deadline)
@@ -4,6 +4,14 @@ from typing import Optional, TypedDict
 from google.cloud import bigquery
 from google.api_core import exceptions as gcloud_exceptions
 
+from bq_client import DEFAULT_DEADLINE_SECONDS, bq_retry, get_client
+
+# 設定は毎回同じなので import 時に 1 回だけ作る（client.query は渡した設定をコピーして使う）
+_DRY_RUN_CFG = bigquery.QueryJobConfig(
+    dry_run=True,
+    use_query_cache=False,  # コスト見積なのでキャッシュは無効化
+)
+
 
 class DryRunResult(TypedDict):
     ok: bool                     # 実行してよさそうか？（max_bytes を超えていない 等）
@@ -18,6 +26,8 @@ def dry_run_query(
     project_id: Optional[str] = None,
     location: Optional[str] = None,
     max_bytes: Optional[int] = None,
+    *,
+    overall_timeout: float = DEFAULT_DEADLINE_SECONDS,
 ) -> DryRunResult:
     """
     BigQuery のクエリを dry-run し、推定スキャン量（bytes_processed）を返す関数。
@@ -27,6 +37,7 @@ def dry_run_query(
         project_id: 実行プロジェクト ID（None の場合は環境デフォルト）
         location: データセットのロケーション（例: "asia-northeast1"）
         max_bytes: このバイト数を超えたら ok=False にするための閾値
+        overall_timeout: 再試行を含めた API 呼び出し全体の締め切り（秒）
 
     Returns:
         DryRunResult:
@@ -36,20 +47,17 @@ def dry_run_query(
             error_type: 例外クラス名
             error_message: エラーメッセージ
     """
-    # クライアント生成（認証は環境変数 GOOGLE_APPLICATION_CREDENTIALS などに依存）
-    if project_id:
-        client = bigquery.Client(project=project_id)
-    else:
-        client = bigquery.Client()
-
-    job_config = bigquery.QueryJobConfig(
-        dry_run=True,
-        use_query_cache=False,  # コスト見積なのでキャッシュは無効化
-    )
+    # クライアントは project_id ごとにキャッシュしたものを再利用
+    client = get_client(project_id)
 
     try:
         # location はデータセットと同じリージョンを指定すること
-        job = client.query(sql, job_config=job_config, location=location)
+        job = client.query(
+            sql,
+            job_config=_DRY_RUN_CFG,
+            location=location,
+            retry=bq_retry(overall_timeout),
+        )
         bytes_processed = job.total_bytes_processed
 
         # max_bytes を超えているかどうかで ok を判断
@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import concurrent.futures
+import time
 from typing import Optional, TypedDict, List, Dict, Any
 from google.cloud import bigquery
 from google.api_core import exceptions as gcloud_exceptions
 
+from bq_client import DEFAULT_DEADLINE_SECONDS, bq_retry, get_client
+
+# BigQuery 側の結果キャッシュを明示的に使う（ヒット時は課金なし・短時間で返る）。
+# 上限なしの設定は毎回同じなので import 時に 1 回だけ作る
+_EXEC_CFG_DEFAULT = bigquery.QueryJobConfig(use_query_cache=True)
+
 
 class ExecuteResult(TypedDict):
     ok: bool
@@ -12,16 +20,50 @@ class ExecuteResult(TypedDict):
     billing_tier: Optional[int]
     num_rows: Optional[int]
     preview_rows: Optional[List[Dict[str, Any]]]
+    reason: Optional[str]        # "MAX_BYTES_BILLED_EXCEEDED" などの機械判定理由
     error_type: Optional[str]
     error_message: Optional[str]
 
 
+def _is_bytes_billed_limit_exceeded(e: gcloud_exceptions.GoogleAPIError) -> bool:
+    """maximum_bytes_billed 超過で JOB が拒否されたエラーかどうか"""
+    for err in getattr(e, "errors", None) or []:
+        if isinstance(err, dict) and err.get("reason") == "bytesBilledLimitExceeded":
+            return True
+    return False
+
+
+def _cancel_job(job: Optional[bigquery.QueryJob]) -> None:
+    """締め切りを過ぎたジョブをサーバー側で止める（ベストエフォート。失敗しても結果には影響させない）"""
+    if job is None:
+        return
+    try:
+        job.cancel()
+    except Exception:
+        pass
+
+
+def _total_bytes_processed(job: bigquery.QueryJob) -> Optional[int]:
+    """
+    完了済みジョブの処理バイト数を、追加の jobs.get を発行せずに読む。
+    jobs.query 経由ではジョブ統計が未取得のことがあるため、初回レスポンスの値で補う。
+    """
+    bytes_processed = job.total_bytes_processed
+    if bytes_processed is None:
+        query_results = getattr(job, "_query_results", None)
+        if query_results is not None:
+            bytes_processed = query_results.total_bytes_processed
+    return bytes_processed
+
+
 def execute_query_with_max_bytes(
     sql: str,
     project_id: Optional[str] = None,
     location: Optional[str] = None,
     maximum_bytes_billed: Optional[int] = None,
     preview_rows_limit: int = 50,
+    *,
+    overall_timeout: float = DEFAULT_DEADLINE_SECONDS,
 ) -> ExecuteResult:
     """
     BigQuery のクエリを実行する関数。
@@ -36,6 +78,8 @@ def execute_query_with_max_bytes(
             超えた場合、JOB はエラー（Billing tier limit exceeded）になる。
         preview_rows_limit:
             結果のプレビューとして返す行数の上限。
+        overall_timeout:
+            再試行・完了待ちを含めた全体の締め切り（秒）。
 
     Returns:
         ExecuteResult:
@@ -45,35 +89,52 @@ def execute_query_with_max_bytes(
             billing_tier: 課金ティア
             num_rows: 結果全体の件数
             preview_rows: 上位 preview_rows_limit 行を dict 形式で返す
+            reason: NG の理由（例: "MAX_BYTES_BILLED_EXCEEDED"）
             error_type, error_message: エラー時の情報
     """
-    if project_id:
-        client = bigquery.Client(project=project_id)
-    else:
-        client = bigquery.Client()
+    deadline = time.monotonic() + overall_timeout
+    client = get_client(project_id)
+    retry = bq_retry(overall_timeout)
 
-    job_config = bigquery.QueryJobConfig()
-    if maximum_bytes_billed is not None:
-        job_config.maximum_bytes_billed = maximum_bytes_billed
+    if maximum_bytes_billed is None:
+        job_config = _EXEC_CFG_DEFAULT
+    else:
+        job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+            maximum_bytes_billed=maximum_bytes_billed,
+        )
 
+    job: Optional[bigquery.QueryJob] = None
     try:
-        job = client.query(sql, job_config=job_config, location=location)
+        # jobs.insert + jobs.get のポーリングではなく jobs.query を使い、
+        # 短いクエリはサーバー側タイムアウト内で 1 往復で結果を受け取る
+        job = client.query(
+            sql,
+            job_config=job_config,
+            location=location,
+            api_method=bigquery.enums.QueryApiMethod.QUERY,
+            retry=retry,
+        )
 
-        # 結果を取得（プレビュー用に page_size を制御）
-        result_iter = job.result(page_size=preview_rows_limit)
+        # 結果を取得（プレビュー用に page_size を制御）。
+        # timeout はジョブ完了までの待ち時間の合計なので、全体の締め切りの残りを渡す
+        result_iter = job.result(
+            page_size=preview_rows_limit,
+            max_results=preview_rows_limit,
+            retry=retry,
+            timeout=max(deadline - time.monotonic(), 0.0),
+        )
 
-        # メタ情報
-        bytes_processed = job.total_bytes_processed
+        # メタ情報（result() 完了時点のジョブから 1 回だけ読む）
+        bytes_processed = _total_bytes_processed(job)
         billing_tier = job.billing_tier
         job_id = job.job_id
 
         # プレビュー行を dict で返す
-        preview_rows: List[Dict[str, Any]] = []
-        for i, row in enumerate(result_iter):
-            if i >= preview_rows_limit:
-                break
-            # Row オブジェクト → dict
-            preview_rows.append(dict(row))
+        # max_results で上限行数だけを取得し、Arrow の列指向テーブルからまとめて dict 化する
+        preview_rows: List[Dict[str, Any]] = result_iter.to_arrow(
+            create_bqstorage_client=False,
+        ).to_pylist()
 
         # 総行数（result_iter.total_rows は遅延評価されているがここで確定する）
         num_rows = result_iter.total_rows
@@ -85,6 +146,7 @@ def execute_query_with_max_bytes(
             billing_tier=billing_tier,
             num_rows=num_rows,
             preview_rows=preview_rows,
+            reason=None,
             error_type=None,
             error_message=None,
         )
@@ -98,6 +160,27 @@ def execute_query_with_max_bytes(
             billing_tier=None,
             num_rows=None,
             preview_rows=None,
+            reason=(
+                "MAX_BYTES_BILLED_EXCEEDED"
+                if _is_bytes_billed_limit_exceeded(e)
+                else "BQ_ERROR"
+            ),
             error_type=e.__class__.__name__,
             error_message=str(e),
         )
+
+    except concurrent.futures.TimeoutError:
+        # 締め切りまでにジョブが終わらなかった（GoogleAPIError ではないので個別に扱う）。
+        # クライアントが待つのをやめてもジョブは実行・課金され続けるので取り消す
+        _cancel_job(job)
+        return ExecuteResult(
+            ok=False,
+            job_id=None,
+            bytes_processed=None,
+            billing_tier=None,
+            num_rows=None,
+            preview_rows=None,
+            reason="TIMEOUT",
+            error_type="TimeoutError",
+            error_message=f"query did not finish within {overall_timeout} seconds",
+        )
@@ -1,6 +1,20 @@
-from typing import Literal, TypedDict, Optional
+import threading
+import time
+from typing import Dict, Literal, TypedDict, Optional, Tuple
+from bq_client import DEFAULT_DEADLINE_SECONDS
 from execute_query_with_max_bytes import ExecuteResult, execute_query_with_max_bytes
-from dry_run import dry_run_query
+from dry_run import DryRunResult, dry_run_query
+
+# BigQuery の課金は参照テーブルごとに最低 10 MiB。maximum_bytes_billed もこれ未満は指定できない
+_MIN_BYTES_BILLED = 10 * 1024**2
+
+# 同じ SQL を短時間に繰り返し実行する場合に dry-run の往復を省くためのキャッシュ。
+# (sql, project_id, location) -> (保存時刻, 推定スキャンバイト数)。
+# 成功した dry-run の推定値だけを持ち、上限判定は呼び出しごとの max_dry_run_bytes で行う。
+_DRY_RUN_CACHE_TTL_SECONDS = 60.0
+_DRY_RUN_CACHE_MAX_SIZE = 512
+_DRY_RUN_CACHE: Dict[Tuple[str, Optional[str], Optional[str]], Tuple[float, int]] = {}
+_DRY_RUN_CACHE_LOCK = threading.Lock()
 
 
 class PlanAndRunResult(TypedDict):
@@ -16,6 +30,9 @@ def plan_and_run_query(
     location: Optional[str] = None,
     max_dry_run_bytes: Optional[int] = None,
     maximum_bytes_billed: Optional[int] = None,
+    *,
+    fast_path: bool = False,
+    overall_timeout: float = DEFAULT_DEADLINE_SECONDS,
 ) -> PlanAndRunResult:
     """
     1) dry-run でコスト見積もり
@@ -23,13 +40,35 @@ def plan_and_run_query(
     3) 超えていなければ maximum_bytes_billed を付けて本番実行
 
     という一連の流れを一本化した関数。
+
+    fast_path=True の場合は dry-run を省略し、maximum_bytes_billed だけを上限として 1 回だけ実行する。
+    max_dry_run_bytes は処理量の見積もりに対する閾値で課金上限とは別物なので、この場合は使わない。
+    BigQuery は参照テーブルごとに最低 10 MiB を課金し、それ未満の maximum_bytes_billed は
+    受け付けないため、上限は 10 MiB 未満なら 10 MiB に切り上げる。
+    上限超過は BigQuery 側で課金前に拒否されるので TOO_EXPENSIVE として返す。
+    この場合、構文エラーや権限エラーは DRY_RUN_ERROR ではなく EXECUTION_ERROR になり、
+    dry_run_bytes は常に None になる。
+
+    overall_timeout は dry-run と本番実行を合わせた全体の締め切り（秒）。
     """
-    # 1. dry-run
-    dry = dry_run_query(
+    if fast_path:
+        return _run_with_bytes_billed_cap(
+            sql=sql,
+            project_id=project_id,
+            location=location,
+            maximum_bytes_billed=maximum_bytes_billed,
+            overall_timeout=overall_timeout,
+        )
+
+    deadline = time.monotonic() + overall_timeout
+
+    # 1. dry-run（直近に同じ SQL を見積もっていればその値を使う）
+    dry = _cached_dry_run(
         sql=sql,
         project_id=project_id,
         location=location,
         max_bytes=max_dry_run_bytes,
+        overall_timeout=overall_timeout,
     )
 
     if not dry["ok"] and dry["reason"] == "MAX_BYTES_EXCEEDED":
@@ -58,6 +97,7 @@ def plan_and_run_query(
         location=location,
         maximum_bytes_billed=maximum_bytes_billed,
         preview_rows_limit=50,
+        overall_timeout=max(deadline - time.monotonic(), 0.0),
     )
 
     if not exec_result["ok"]:
@@ -78,3 +118,108 @@ def plan_and_run_query(
             f"行数 {exec_result['num_rows']} 行。"
         ),
     )
+
+
+def _cached_dry_run(
+    sql: str,
+    project_id: Optional[str],
+    location: Optional[str],
+    max_bytes: Optional[int],
+    overall_timeout: float,
+) -> DryRunResult:
+    """
+    dry_run_query の結果を _DRY_RUN_CACHE_TTL_SECONDS 秒だけ再利用する。
+    キャッシュから返す場合も max_bytes による判定は dry_run_query と同じく毎回行う。
+    """
+    key = (sql, project_id, location)
+    now = time.monotonic()
+
+    with _DRY_RUN_CACHE_LOCK:
+        entry = _DRY_RUN_CACHE.get(key)
+    if entry is not None and now - entry[0] < _DRY_RUN_CACHE_TTL_SECONDS:
+        bytes_processed = entry[1]
+        if max_bytes is not None and bytes_processed > max_bytes:
+            return DryRunResult(
+                ok=False,
+                bytes_processed=bytes_processed,
+                reason="MAX_BYTES_EXCEEDED",
+                error_type=None,
+                error_message=None,
+            )
+        return DryRunResult(
+            ok=True,
+            bytes_processed=bytes_processed,
+            reason=None,
+            error_type=None,
+            error_message=None,
+        )
+
+    dry = dry_run_query(
+        sql=sql,
+        project_id=project_id,
+        location=location,
+        max_bytes=max_bytes,
+        overall_timeout=overall_timeout,
+    )
+
+    # 見積もり自体が成功したもの（上限超過を含む）だけを保存する。BQ_ERROR は保存しない
+    if dry["bytes_processed"] is not None and dry["reason"] != "BQ_ERROR":
+        with _DRY_RUN_CACHE_LOCK:
+            _DRY_RUN_CACHE.pop(key, None)
+            _DRY_RUN_CACHE[key] = (now, dry["bytes_processed"])
+            # dict は挿入順を保つので、先頭から捨てれば FIFO になる
+            while len(_DRY_RUN_CACHE) > _DRY_RUN_CACHE_MAX_SIZE:
+                del _DRY_RUN_CACHE[next(iter(_DRY_RUN_CACHE))]
+
+    return dry
+
+
+def _run_with_bytes_billed_cap(
+    sql: str,
+    project_id: Optional[str],
+    location: Optional[str],
+    maximum_bytes_billed: Optional[int],
+    overall_timeout: float,
+) -> PlanAndRunResult:
+    """dry-run を挟まず、maximum_bytes_billed による上限だけで 1 往復で実行する"""
+    bytes_cap = (
+        max(maximum_bytes_billed, _MIN_BYTES_BILLED)
+        if maximum_bytes_billed is not None
+        else None
+    )
+
+    exec_result = execute_query_with_max_bytes(
+        sql=sql,
+        project_id=project_id,
+        location=location,
+        maximum_bytes_billed=bytes_cap,
+        preview_rows_limit=50,
+        overall_timeout=overall_timeout,
+    )
+
+    if not exec_result["ok"] and exec_result["reason"] == "MAX_BYTES_BILLED_EXCEEDED":
+        return PlanAndRunResult(
+            status="TOO_EXPENSIVE",
+            dry_run_bytes=None,
+            execute_result=exec_result,
+            message=f"上限 {bytes_cap} bytes を超えるため BigQuery 側で実行が拒否されました。",
+        )
+
+    if not exec_result["ok"]:
+        return PlanAndRunResult(
+            status="EXECUTION_ERROR",
+            dry_run_bytes=None,
+            execute_result=exec_result,
+            message=f"実行時にエラー発生: {exec_result['error_type']} - {exec_result['error_message']}",
+        )
+
+    return PlanAndRunResult(
+        status="SUCCESS",
+        dry_run_bytes=None,
+        execute_result=exec_result,
+        message=(
+            f"クエリ実行に成功しました。"
+            f"実際の処理 {exec_result['bytes_processed']} bytes, "
+            f"行数 {exec_result['num_rows']} 行。"
+        ),
+    )
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+import google.auth
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
+
+
+_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+_creds: Optional[Credentials] = None
+_lock = threading.Lock()
+
+
+def get_access_token() -> str:
+    """
+    Vertex AI 呼び出し用のアクセストークンを返す。
+    認証情報はプロセス内で使い回し、期限切れ（または未取得）のときだけ refresh する。
+    """
+    global _creds
+    with _lock:
+        if _creds is None:
+            _creds, _ = google.auth.default(scopes=_SCOPES)
+        if not _creds.valid:
+            _creds.refresh(Request())
+        token = _creds.token
+
+    if not token:
+        raise RuntimeError("failed to obtain access token for Vertex AI")
+    return token
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import atexit
+
+import httpx
+
+
+# Vertex AI（埋め込み・生成）への HTTP 接続はプロセス内で 1 つのプールを共有する。
+# 同じホストへの呼び出しは HTTP/2 で少数の TLS 接続に多重化される。
+# タイムアウトは呼び出し側で用途ごとに指定する
+_HTTP = httpx.Client(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+)
+atexit.register(_HTTP.close)
+
+
+def get_http_client() -> httpx.Client:
+    """Vertex AI 呼び出し用の共有 httpx.Client を返す"""
+    return _HTTP
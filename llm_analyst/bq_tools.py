@@ -1,16 +1,35 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
+import copy
+import hashlib
 import os
 import re
-from dataclasses import dataclass
-from typing import Literal, Optional, List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Literal, Optional, List, Dict, Any, Tuple
 
 from typing_extensions import TypedDict  # ★ 重要: typing.TypedDict ではなくこちら
+from cachetools import TTLCache
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
 from google.cloud import bigquery
+from google.cloud.bigquery.retry import DEFAULT_RETRY
 from google.api_core import exceptions as gcloud_exceptions
-import google.auth
-from google.auth.transport.requests import Request
+from google.api_core.retry import Retry
 import httpx
+import orjson
+
+from _gcp_auth import get_access_token
+from _vertex_http import get_http_client
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery_storage
 
 
 # ---------------------------
@@ -32,6 +51,9 @@ try:
 except ValueError:
     EMBEDDING_TOP_K = 8
 
+# 埋め込み API 呼び出しのタイムアウト（接続は _vertex_http の共有クライアントを使う）
+_EMBEDDING_TIMEOUT = httpx.Timeout(20.0, connect=5.0)
+
 # ---------------------------
 # Allowlist (hard-coded for now)
 #   Only allow querying tables in:
@@ -40,16 +62,45 @@ except ValueError:
 
 ALLOW_PROJECT_ID = "bigquery-public-data"
 ALLOW_DATASET_ID = "ncaa_basketball"
+_ALLOWED_DATASET = (ALLOW_PROJECT_ID, ALLOW_DATASET_ID)
+
+
+# PROJECT_ID 優先、なければ GOOGLE_CLOUD_PROJECT（プロセス中は変わらないので import 時に確定）
+_DEFAULT_PROJECT_ID = PROJECT_ID or GCP_DEFAULT_PROJECT or None
 
 
 def _resolve_project_id(explicit_project_id: Optional[str]) -> Optional[str]:
-    if explicit_project_id:
-        return explicit_project_id
-    if PROJECT_ID:
-        return PROJECT_ID
-    if GCP_DEFAULT_PROJECT:
-        return GCP_DEFAULT_PROJECT
-    return None
+    return explicit_project_id or _DEFAULT_PROJECT_ID
+
+
+_BQ_CLIENT_LOCK = threading.Lock()
+_BQ_CLIENTS: Dict[Optional[str], bigquery.Client] = {}
+
+
+# BigQuery REST 呼び出しの keep-alive 接続をいくつまで持つか。
+# requests の既定（10 本）では plan_and_run_queries_async 等で 10 スレッドを超えて並行すると
+# 返却された接続が捨てられ、次の呼び出しが TCP / TLS ハンドシェイクからやり直しになる
+_BQ_HTTP_POOL_MAXSIZE = 32
+
+
+def _create_bq_client(project_id: Optional[str]) -> bigquery.Client:
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    # 再試行は api_core の Retry（_bq_retry）に任せるので、アダプタ側では行わない
+    session.mount("https://", HTTPAdapter(pool_maxsize=_BQ_HTTP_POOL_MAXSIZE))
+    return bigquery.Client(project=project_id or None, credentials=credentials, _http=session)
+
+
+def _get_client(project_id: Optional[str]) -> bigquery.Client:
+    """project_id ごとに bigquery.Client を使い回す（認証・HTTP セッションの初期化を 1 回にする）"""
+    # 生成済みならロックを取らずに返す。生成だけはロック内で二重チェックして 1 回にする
+    client = _BQ_CLIENTS.get(project_id)
+    if client is None:
+        with _BQ_CLIENT_LOCK:
+            client = _BQ_CLIENTS.get(project_id)
+            if client is None:
+                client = _BQ_CLIENTS[project_id] = _create_bq_client(project_id)
+    return client
 
 
 def _resolve_vertex_location() -> Optional[str]:
@@ -60,15 +111,6 @@ def _resolve_vertex_location() -> Optional[str]:
     return None
 
 
-def _strip_embedding_fields(row: Dict[str, Any]) -> Dict[str, Any]:
-    cleaned: Dict[str, Any] = {}
-    for key, value in row.items():
-        if isinstance(value, list) and value and all(isinstance(v, (int, float)) for v in value):
-            continue
-        cleaned[key] = value
-    return cleaned
-
-
 def _extract_table_column(row: Dict[str, Any]) -> Optional[Dict[str, str]]:
     table = (
         row.get("table_name")
@@ -112,14 +154,65 @@ def _extract_table_column(row: Dict[str, Any]) -> Optional[Dict[str, str]]:
     return result
 
 
-def generate_text_embedding(
-    text: str,
+# 同じテキストの埋め込みは Vertex AI を呼ばずに返す（完全一致・LRU）。
+# キーにモデル名を含め、モデル切り替え後に古い埋め込みを返さないようにする。
+_EMBEDDING_CACHE_MAX_SIZE = 512
+_EMBEDDING_CACHE: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMBEDDING_CACHE_LOCK = threading.Lock()
+
+
+def _embedding_cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}|{text}".encode("utf-8")).hexdigest()
+
+
+# 1 リクエストに載せられる instances 数の上限。
+# gemini-embedding-001 は 1 件ずつしか受け付けないため、それ以外のモデルのみまとめて送る。
+_EMBEDDING_MAX_INSTANCES = 250
+
+# 1 テキストあたりの最大文字数（モデルの入力トークン上限を超えないよう余裕を持たせる）
+_EMBEDDING_MAX_CHARS = 8192
+
+
+def _embedding_batch_size(model_name: str) -> int:
+    return 1 if model_name.startswith("gemini-embedding") else _EMBEDDING_MAX_INSTANCES
+
+
+class EmbeddingHTTPError(RuntimeError):
+    """埋め込み API が HTTP エラーを返した（呼び出し側が再試行の要否を判断できるようステータスを持つ）"""
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def embedding_batch_size(model: Optional[str] = None) -> int:
+    """1 回の predict にまとめて送れるテキスト数（model 省略時は EMBEDDING_MODEL）"""
+    return _embedding_batch_size(model or EMBEDDING_MODEL)
+
+
+def _parse_embedding(prediction: Any) -> List[float]:
+    prediction = prediction or {}
+    embeddings = prediction.get("embeddings") or prediction.get("embedding") or prediction
+    values = embeddings.get("values") if isinstance(embeddings, dict) else None
+    if not values or not isinstance(values, list):
+        raise RuntimeError("Vertex AI response missing embedding values")
+    return values
+
+
+def generate_text_embeddings(
+    texts: List[str],
     *,
     project_id: str,
     model: Optional[str] = None,
     location: Optional[str] = None,
-) -> List[float]:
-    if not text:
+) -> List[List[float]]:
+    """
+    複数テキストの埋め込みをまとめて取得する（戻り値は texts と同じ順序）。
+    キャッシュにないテキストだけを instances に詰めて、できるだけ少ない往復で Vertex AI に送る。
+    """
+    # 空白だけのテキストは認証・HTTP を発生させる前に弾き、長すぎる入力は切り詰める
+    texts = [(text or "").strip()[:_EMBEDDING_MAX_CHARS] for text in texts]
+    if not texts or any(not text for text in texts):
         raise ValueError("text is empty")
 
     resolved_location = location or _resolve_vertex_location()
@@ -130,37 +223,116 @@ def generate_text_embedding(
     if not model_name:
         raise RuntimeError("EMBEDDING_MODEL is not set")
 
-    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    credentials.refresh(Request())
-    if not credentials.token:
-        raise RuntimeError("failed to obtain access token for Vertex AI")
-
-    url = (
-        f"https://{resolved_location}-aiplatform.googleapis.com/v1/projects/"
-        f"{project_id}/locations/{resolved_location}/publishers/google/models/"
-        f"{model_name}:predict"
-    )
-    payload = {"instances": [{"content": text}]}
-    headers = {"Authorization": f"Bearer {credentials.token}"}
-
-    with httpx.Client(timeout=20.0) as client:
-        resp = client.post(url, json=payload, headers=headers)
-        try:
-            resp.raise_for_status()
-        except Exception as exc:
-            raise RuntimeError(f"Vertex AI error: {resp.status_code} {resp.text[:300]}") from exc
+    cache_keys = [_embedding_cache_key(model_name, text) for text in texts]
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    missing: Dict[str, List[int]] = {}  # cache_key -> texts 内の位置（重複テキストは 1 回だけ送る）
+    with _EMBEDDING_CACHE_LOCK:
+        for i, cache_key in enumerate(cache_keys):
+            cached = _EMBEDDING_CACHE.get(cache_key)
+            if cached is not None:
+                _EMBEDDING_CACHE.move_to_end(cache_key)
+                results[i] = cached
+            else:
+                missing.setdefault(cache_key, []).append(i)
+
+    if missing:
+        url = (
+            f"https://{resolved_location}-aiplatform.googleapis.com/v1/projects/"
+            f"{project_id}/locations/{resolved_location}/publishers/google/models/"
+            f"{model_name}:predict"
+        )
+        headers = {
+            "Authorization": f"Bearer {get_access_token()}",
+            "Content-Type": "application/json",
+        }
+
+        missing_keys = list(missing)
+        batch_size = _embedding_batch_size(model_name)
+        for start in range(0, len(missing_keys), batch_size):
+            batch_keys = missing_keys[start:start + batch_size]
+            payload = {
+                "instances": [{"content": texts[missing[key][0]]} for key in batch_keys]
+            }
+
+            resp = get_http_client().post(
+                url,
+                content=orjson.dumps(payload),
+                headers=headers,
+                timeout=_EMBEDDING_TIMEOUT,
+            )
+            try:
+                resp.raise_for_status()
+            except Exception as exc:
+                raise EmbeddingHTTPError(
+                    resp.status_code,
+                    f"Vertex AI error: {resp.status_code} {resp.text[:300]}",
+                ) from exc
+
+            data = orjson.loads(resp.content)
+            predictions = data.get("predictions") or []
+            if len(predictions) != len(batch_keys):
+                raise RuntimeError("Vertex AI response missing predictions")
+
+            batch_values = [_parse_embedding(p) for p in predictions]
+            for key, values in zip(batch_keys, batch_values):
+                for i in missing[key]:
+                    results[i] = values
+
+            with _EMBEDDING_CACHE_LOCK:
+                for key, values in zip(batch_keys, batch_values):
+                    _EMBEDDING_CACHE[key] = values
+                    _EMBEDDING_CACHE.move_to_end(key)
+                while len(_EMBEDDING_CACHE) > _EMBEDDING_CACHE_MAX_SIZE:
+                    _EMBEDDING_CACHE.popitem(last=False)
+
+    return results  # type: ignore[return-value]
 
-    data = resp.json()
-    predictions = data.get("predictions") or []
-    if not predictions:
-        raise RuntimeError("Vertex AI response missing predictions")
 
-    first = predictions[0] or {}
-    embeddings = first.get("embeddings") or first.get("embedding") or first
-    values = embeddings.get("values") if isinstance(embeddings, dict) else None
-    if not values or not isinstance(values, list):
-        raise RuntimeError("Vertex AI response missing embedding values")
-    return values
+def generate_text_embedding(
+    text: str,
+    *,
+    project_id: str,
+    model: Optional[str] = None,
+    location: Optional[str] = None,
+) -> List[float]:
+    return generate_text_embeddings(
+        [text],
+        project_id=project_id,
+        model=model,
+        location=location,
+    )[0]
+
+
+# テーブル名・列名はクエリパラメータにできないため、import 時に検証してから 1 回だけ埋め込む。
+# SQL テキストが呼び出しごとに変わらないので、BigQuery の結果キャッシュにも乗りやすい。
+#
+# VECTOR_SEARCH はベクトルインデックスがあれば自動的に ANN 検索になる（無ければ全件の総当たり）。
+# メタデータが増えてきたら（IVF は 5,000 行以上が必要）一度だけ次を実行しておく:
+#   CREATE VECTOR INDEX IF NOT EXISTS embedding_meta_data_ivf
+#   ON `<EMBEDDING_META_TABLE>`(<EMBEDDING_COLUMN>)
+#   OPTIONS(index_type = 'IVF', distance_type = 'COSINE');
+if not re.fullmatch(r"[A-Za-z0-9_.\-]+", EMBEDDING_META_TABLE):
+    raise RuntimeError(f"invalid EMBEDDING_META_TABLE: {EMBEDDING_META_TABLE!r}")
+if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", EMBEDDING_COLUMN):
+    raise RuntimeError(f"invalid EMBEDDING_COLUMN: {EMBEDDING_COLUMN!r}")
+
+_VECTOR_SEARCH_SQL = f"""
+SELECT
+  base.table_name,
+  base.column_name,
+  base.table_description,
+  base.column_description,
+  base.data_type,
+  distance
+FROM VECTOR_SEARCH(
+  TABLE `{EMBEDDING_META_TABLE}`,
+  '{EMBEDDING_COLUMN}',
+  (SELECT @query_embedding AS {EMBEDDING_COLUMN}),
+  top_k => @top_k,
+  distance_type => 'COSINE'
+)
+LIMIT @top_k
+"""
 
 
 def search_embedding_meta_data(
@@ -168,32 +340,21 @@ def search_embedding_meta_data(
     *,
     project_id: Optional[str] = None,
     top_k: Optional[int] = None,
+    query_embedding: Optional[List[float]] = None,
 ) -> Dict[str, Any]:
+    """
+    text に意味的に近いテーブル / カラムのメタデータを VECTOR_SEARCH で検索する。
+    query_embedding を渡した場合は埋め込みの生成を省略する（呼び出し側でまとめて生成した場合など）。
+    """
     effective_project_id = _resolve_project_id(project_id)
     if not effective_project_id:
         raise RuntimeError("PROJECT_ID / GOOGLE_CLOUD_PROJECT not set")
 
-    query_embedding = generate_text_embedding(text, project_id=effective_project_id)
-    client = bigquery.Client(project=effective_project_id)
+    if query_embedding is None:
+        query_embedding = generate_text_embedding(text, project_id=effective_project_id)
+    client = _get_client(effective_project_id)
 
     resolved_top_k = top_k or EMBEDDING_TOP_K
-    sql = f"""
-    SELECT
-      base.table_name,
-      base.column_name,
-      base.table_description,
-      base.column_description,
-      base.data_type,
-      distance
-    FROM VECTOR_SEARCH(
-      TABLE `{EMBEDDING_META_TABLE}`,
-      '{EMBEDDING_COLUMN}',
-      (SELECT @query_embedding AS {EMBEDDING_COLUMN}),
-      top_k => @top_k,
-      distance_type => 'COSINE'
-    )
-    LIMIT @top_k
-    """
 
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
@@ -202,12 +363,12 @@ def search_embedding_meta_data(
         ]
     )
 
-    job = client.query(sql, job_config=job_config, location=BQ_LOCATION)
+    job = client.query(_VECTOR_SEARCH_SQL, job_config=job_config, location=BQ_LOCATION)
+    # SELECT で埋め込み列を除いた列だけを明示しているので、ベクトルはクライアントに届かない
     rows = [dict(row) for row in job.result()]
 
-    cleaned_rows = [_strip_embedding_fields(r) for r in rows]
     extracted_items = []
-    for row in cleaned_rows:
+    for row in rows:
         item = _extract_table_column(row)
         if item:
             extracted_items.append(item)
@@ -219,11 +380,30 @@ def search_embedding_meta_data(
     }
 
 
+def warmup(project_id: Optional[str] = None) -> None:
+    """
+    起動直後に 1 回呼び、初回リクエストのコールドスタート（TCP / TLS・OAuth トークン取得・
+    BigQuery クライアント初期化）をユーザーのリクエストの外で済ませておく。
+    """
+    effective_project_id = _resolve_project_id(project_id)
+    if not effective_project_id:
+        raise RuntimeError("PROJECT_ID / GOOGLE_CLOUD_PROJECT not set")
+
+    client = _get_client(effective_project_id)
+    client.query(
+        "SELECT 1",
+        job_config=_DRY_RUN_CFG,
+        location=BQ_LOCATION,
+    )
+    get_access_token()
+    generate_text_embedding("warmup", project_id=effective_project_id)
+
+
 # ---------------------------
 # SQL Validator (non-LLM)
 # ---------------------------
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SqlValidationResult:
     ok: bool
     reason: Optional[str] = None
@@ -241,119 +421,71 @@ FORBIDDEN_KEYWORDS = {
     "grant", "revoke", "export", "load", "copy", "call",
 }
 
+# これより長い SQL はトークナイズせずに拒否する（LLM が巨大なゴミ文字列を返した場合の保険）
+MAX_SQL_LENGTH = 64 * 1024
 
-def _strip_comments(sql: str) -> str:
-    """-- と /* */ コメントを除去（文字列リテラル内は保持する簡易実装）"""
-    out = []
-    i = 0
-    n = len(sql)
-    in_sq = False  # '
-    in_dq = False  # "
-    while i < n:
-        ch = sql[i]
-        nxt = sql[i + 1] if i + 1 < n else ""
-
-        # quotes toggle
-        if not in_dq and ch == "'" and not in_sq:
-            in_sq = True
-            out.append(ch)
-            i += 1
-            continue
-        elif in_sq and ch == "'":
-            if nxt == "'":  # escaped ''
-                out.append("''")
-                i += 2
-                continue
-            in_sq = False
-            out.append(ch)
-            i += 1
-            continue
-
-        if not in_sq and ch == '"' and not in_dq:
-            in_dq = True
-            out.append(ch)
-            i += 1
-            continue
-        elif in_dq and ch == '"':
-            in_dq = False
-            out.append(ch)
-            i += 1
-            continue
+# 長いキーワードを優先するため長さ降順で 1 本の正規表現にまとめ、import 時に 1 回だけコンパイル
+_FORBIDDEN_RE = re.compile(
+    r"\b("
+    + "|".join(re.escape(kw) for kw in sorted(FORBIDDEN_KEYWORDS, key=len, reverse=True))
+    + r")\b",
+    re.IGNORECASE,
+)
+_LIMIT_RE = re.compile(r"\blimit\b", re.IGNORECASE)
+_WS_RE = re.compile(r"[ \t]+")
+_SELECT_OR_WITH_RE = re.compile(r"\s*(?:select|with)", re.IGNORECASE)
+
+
+# 文字列リテラル・コメント・セミコロンを 1 本の正規表現で走査する。
+# 閉じていないリテラル / ブロックコメントは末尾までを 1 トークンとして扱う。
+_SQL_TOKEN_RE = re.compile(
+    r"""
+      (?P<single_quoted>'(?:[^']|'')*(?:'|\Z))
+    | (?P<double_quoted>"[^"]*(?:"|\Z))
+    | (?P<line_comment>--[^\n\r]*)
+    | (?P<block_comment>/\*.*?(?:\*/|\Z))
+    | (?P<semicolon>;)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
 
-        # comments (only outside quotes)
-        if not in_sq and not in_dq:
-            if ch == "-" and nxt == "-":
-                i += 2
-                while i < n and sql[i] not in ("\n", "\r"):
-                    i += 1
-                continue
-            if ch == "/" and nxt == "*":
-                i += 2
-                while i + 1 < n and not (sql[i] == "*" and sql[i + 1] == "/"):
-                    i += 1
-                i += 2
-                continue
-
-        out.append(ch)
-        i += 1
-    return "".join(out)
-
-
-def _has_semicolon_outside_quotes(sql: str) -> bool:
-    in_sq = False
-    in_dq = False
-    i = 0
-    n = len(sql)
-    while i < n:
-        ch = sql[i]
-        nxt = sql[i + 1] if i + 1 < n else ""
-        if not in_dq and ch == "'" and not in_sq:
-            in_sq = True
-            i += 1
-            continue
-        if in_sq and ch == "'":
-            if nxt == "'":
-                i += 2
-                continue
-            in_sq = False
-            i += 1
-            continue
-        if not in_sq and ch == '"' and not in_dq:
-            in_dq = True
-            i += 1
-            continue
-        if in_dq and ch == '"':
-            in_dq = False
-            i += 1
-            continue
 
-        if not in_sq and not in_dq and ch == ";":
-            return True
-        i += 1
-    return False
+def _scan_sql(sql: str) -> Tuple[str, bool]:
+    """
+    -- と /* */ コメントを除去し、クォート外のセミコロン有無を同時に判定する。
+    戻り値: (コメント除去後の SQL, クォート外に ; があるか)
+    """
+    out: List[str] = []
+    has_semicolon = False
+    pos = 0
+    for m in _SQL_TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind == "line_comment" or kind == "block_comment":
+            out.append(sql[pos:m.start()])
+            pos = m.end()
+        elif kind == "semicolon":
+            has_semicolon = True
+    out.append(sql[pos:])
+    return "".join(out), has_semicolon
 
 
 def _normalize_spaces(sql: str) -> str:
     sql = sql.strip()
-    sql = re.sub(r"[ \t]+", " ", sql)
+    sql = _WS_RE.sub(" ", sql)
     return sql
 
 
 def _starts_with_select_or_with(sql: str) -> bool:
-    head = sql.lstrip().lower()
-    return head.startswith("select") or head.startswith("with")
+    return _SELECT_OR_WITH_RE.match(sql) is not None
 
 
 def _contains_forbidden_keyword(sql: str) -> Optional[str]:
-    lowered = sql.lower()
-    for kw in sorted(FORBIDDEN_KEYWORDS, key=len, reverse=True):
-        if re.search(rf"\b{re.escape(kw)}\b", lowered):
-            return kw
-    return None
+    m = _FORBIDDEN_RE.search(sql)
+    return m.group(1).lower() if m else None
 
 
 def _ensure_limit(sql: str, default_limit: int) -> str:
-    if re.search(r"\blimit\b", sql.lower()):
+    if _LIMIT_RE.search(sql):
         return sql
     return f"{sql.rstrip()}\nLIMIT {default_limit}"
 
@@ -362,10 +494,26 @@ def validate_sql(raw_sql: str, *, default_limit: int = 1000) -> SqlValidationRes
     if not raw_sql or not raw_sql.strip():
         return SqlValidationResult(False, "EMPTY_SQL")
 
-    sql = _strip_comments(raw_sql)
+    if len(raw_sql) > MAX_SQL_LENGTH:
+        return SqlValidationResult(False, "SQL_TOO_LONG")
+
+    if len(raw_sql) > _VALIDATE_CACHE_MAX_SQL_LENGTH:
+        return _validate_sql_cached.__wrapped__(raw_sql, default_limit)
+    return _validate_sql_cached(raw_sql, default_limit)
+
+
+# 同じ SQL の再投入（貼り直し・LLM のリトライ）では検証をやり直さない。
+# 保持するのは 8 KiB 以下の SQL だけ・最大 128 件（元の SQL と整形後の SQL で最悪 2 MiB 程度）。
+# それより長い SQL は毎回検証する
+_VALIDATE_CACHE_MAX_SQL_LENGTH = 8 * 1024
+
+
+@lru_cache(maxsize=128)
+def _validate_sql_cached(raw_sql: str, default_limit: int) -> SqlValidationResult:
+    sql, has_semicolon = _scan_sql(raw_sql)
     sql = _normalize_spaces(sql)
 
-    if _has_semicolon_outside_quotes(sql):
+    if has_semicolon:
         return SqlValidationResult(False, "MULTI_STATEMENT_NOT_ALLOWED")
 
     if not _starts_with_select_or_with(sql):
@@ -384,10 +532,10 @@ def validate_sql(raw_sql: str, *, default_limit: int = 1000) -> SqlValidationRes
 # ---------------------------
 
 def _validate_referenced_tables_allowlist(
-    referenced_tables: Optional[List[Dict[str, str]]],
+    referenced_tables: Optional[Tuple[Tuple[str, str, str], ...]],
 ) -> Optional[str]:
     """
-    referenced_tables: [{"projectId": "...", "datasetId": "...", "tableId": "..."} ...]
+    referenced_tables: ((project, dataset, table), ...)
     戻り値:
       - None: OK
       - "TOO_MANY_REFERENCED_TABLES": 参照が多すぎて安全に判定できないので拒否
@@ -406,12 +554,34 @@ def _validate_referenced_tables_allowlist(
     if len(referenced_tables) >= 50:
         return "TOO_MANY_REFERENCED_TABLES"
 
-    for t in referenced_tables:
-        p = t.get("projectId")
-        d = t.get("datasetId")
-        tb = t.get("tableId")
-        if p != ALLOW_PROJECT_ID or d != ALLOW_DATASET_ID:
-            return f"{p}.{d}.{tb}"
+    for project, dataset, table in referenced_tables:
+        if (project, dataset) != _ALLOWED_DATASET:
+            return f"{project}.{dataset}.{table}"
+    return None
+
+
+def _find_disallowed_table_locally(sql: str) -> Optional[str]:
+    """
+    dry-run の前に SQL をローカルでパースし、明らかな allowlist 違反を検出する。
+    戻り値:
+      - None: 違反なし（またはパースできず判定不能。最終判定は dry-run の参照テーブルで行う）
+      - "<proj>.<dataset>.<table>": project / dataset まで明示された allowlist 外の参照
+    """
+    # sqlglot は import だけで 100ms 程度かかり、Slack Gateway の経路では使わないので必要になるまで読み込まない
+    import sqlglot
+    from sqlglot import exp
+
+    try:
+        tree = sqlglot.parse_one(sql, read="bigquery")
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    for t in tree.find_all(exp.Table):
+        # CTE 名や dataset 省略の参照はここでは判定せず dry-run に任せる
+        if not t.catalog or not t.db:
+            continue
+        if (t.catalog, t.db) != _ALLOWED_DATASET:
+            return f"{t.catalog}.{t.db}.{t.name}"
     return None
 
 
@@ -422,7 +592,7 @@ def _validate_referenced_tables_allowlist(
 class DryRunResult(TypedDict):
     ok: bool
     bytes_processed: Optional[int]
-    referenced_tables: Optional[List[Dict[str, str]]]
+    referenced_tables: Optional[Tuple[Tuple[str, str, str], ...]]  # (project, dataset, table)
     reason: Optional[str]
     error_type: Optional[str]
     error_message: Optional[str]
@@ -451,57 +621,195 @@ class PlanAndRunResult(TypedDict):
 # BigQuery execution (location is env-only)
 # ---------------------------
 
+# API 呼び出し・完了待ちの再試行。バックオフは 60 秒で頭打ちにし、全体の締め切りを必ず設ける
+_DEFAULT_DEADLINE_SECONDS = 600.0
+_BQ_RETRY = DEFAULT_RETRY.with_delay(initial=0.25, maximum=60.0, multiplier=1.5)
+
+
+def _bq_retry(deadline: float) -> Retry:
+    return _BQ_RETRY.with_deadline(deadline)
+
+
+# 固定の QueryJobConfig は import 時に 1 回だけ作って使い回す（client.query は渡した設定をコピーして使う）
+_DRY_RUN_CFG = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+# BigQuery 側の結果キャッシュも明示的に使う（ヒット時は課金なし・短時間で返る）
+_EXEC_CFG_DEFAULT = bigquery.QueryJobConfig(use_query_cache=True)
+
+
+# dry-run の見積もり結果（bytes_processed, referenced_tables）を SQL ごとに短時間キャッシュする。
+# LLM のリトライ等で同じ SQL が繰り返し来ても dry-run の RPC を打たない。
+# BQ_ERROR は一時的な失敗の可能性があるのでキャッシュしない。
+_DRY_RUN_CACHE: "TTLCache[str, Tuple[Optional[int], Tuple[Tuple[str, str, str], ...]]]" = TTLCache(
+    maxsize=512,
+    ttl=300,
+)
+_DRY_RUN_CACHE_LOCK = threading.Lock()
+
+
+def _dry_run_cache_key(sql: str, project_id: Optional[str]) -> str:
+    digest = hashlib.blake2b(sql.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{project_id or ''}|{BQ_LOCATION or ''}|{digest}"
+
+
 def dry_run_query(
     sql: str,
     project_id: Optional[str] = None,
     max_bytes: Optional[int] = None,
+    *,
+    overall_timeout: float = _DEFAULT_DEADLINE_SECONDS,
 ) -> DryRunResult:
     effective_project_id = _resolve_project_id(project_id)
-    client = bigquery.Client(project=effective_project_id) if effective_project_id else bigquery.Client()
+    cache_key = _dry_run_cache_key(sql, effective_project_id)
 
-    job_config = bigquery.QueryJobConfig(
-        dry_run=True,
-        use_query_cache=False,
-    )
+    with _DRY_RUN_CACHE_LOCK:
+        cached = _DRY_RUN_CACHE.get(cache_key)
 
-    try:
-        job = client.query(sql, job_config=job_config, location=BQ_LOCATION)
-        bytes_processed = job.total_bytes_processed
+    if cached is None:
+        client = _get_client(effective_project_id)
 
-        # referenced tables を正規化して dict にする
-        refs: List[Dict[str, str]] = []
-        for r in (job.referenced_tables or []):
-            # TableReference: project / dataset_id / table_id
-            refs.append({"projectId": r.project, "datasetId": r.dataset_id, "tableId": r.table_id})
-
-        if max_bytes is not None and bytes_processed is not None and bytes_processed > max_bytes:
+        try:
+            job = client.query(
+                sql,
+                job_config=_DRY_RUN_CFG,
+                location=BQ_LOCATION,
+                retry=_bq_retry(overall_timeout),
+            )
+        except gcloud_exceptions.GoogleAPIError as e:
             return DryRunResult(
                 ok=False,
-                bytes_processed=bytes_processed,
-                referenced_tables=refs,
-                reason="MAX_BYTES_EXCEEDED",
-                error_type=None,
-                error_message=None,
+                bytes_processed=None,
+                referenced_tables=None,
+                reason="BQ_ERROR",
+                error_type=e.__class__.__name__,
+                error_message=str(e),
             )
 
+        # referenced tables を (project, dataset, table) のタプルに正規化する
+        refs = tuple(
+            (r.project, r.dataset_id, r.table_id)
+            for r in (job.referenced_tables or ())
+        )
+
+        cached = (job.total_bytes_processed, refs)
+        with _DRY_RUN_CACHE_LOCK:
+            _DRY_RUN_CACHE[cache_key] = cached
+
+    # max_bytes は呼び出しごとに異なり得るので、判定はキャッシュの外で行う
+    bytes_processed, refs = cached
+
+    if max_bytes is not None and bytes_processed is not None and bytes_processed > max_bytes:
         return DryRunResult(
-            ok=True,
+            ok=False,
             bytes_processed=bytes_processed,
             referenced_tables=refs,
-            reason=None,
+            reason="MAX_BYTES_EXCEEDED",
             error_type=None,
             error_message=None,
         )
 
-    except gcloud_exceptions.GoogleAPIError as e:
-        return DryRunResult(
-            ok=False,
-            bytes_processed=None,
-            referenced_tables=None,
-            reason="BQ_ERROR",
-            error_type=e.__class__.__name__,
-            error_message=str(e),
-        )
+    return DryRunResult(
+        ok=True,
+        bytes_processed=bytes_processed,
+        referenced_tables=refs,
+        reason=None,
+        error_type=None,
+        error_message=None,
+    )
+
+
+# 実行結果（プレビュー行を含む）も SQL・課金上限・プレビュー行数ごとに短時間キャッシュする。
+# 同じセッションでの再探索は BigQuery へ RPC を打たずに返す。失敗結果はキャッシュしない。
+_EXECUTE_CACHE: "TTLCache[Tuple[str, Optional[int], int], ExecuteResult]" = TTLCache(
+    maxsize=128,
+    ttl=60,
+)
+_EXECUTE_CACHE_LOCK = threading.Lock()
+
+
+@dataclass(slots=True)
+class _PendingExecute:
+    """実行中のジョブの完了通知と結果（失敗も含む）。同じキーの後続呼び出しはこれを待って結果を共有する"""
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[ExecuteResult] = None
+
+
+_EXECUTE_INFLIGHT: Dict[Tuple[str, Optional[int], int], _PendingExecute] = {}
+
+
+def _copy_execute_result(result: ExecuteResult) -> ExecuteResult:
+    """キャッシュ・共有中の結果を呼び出し側で書き換えられても汚れないよう、プレビュー行まで複製する"""
+    copied = ExecuteResult(**result)
+    if result["preview_rows"] is not None:
+        copied["preview_rows"] = copy.deepcopy(result["preview_rows"])
+    return copied
+
+
+def _failed_execute_result(error_type: str, error_message: str) -> ExecuteResult:
+    return ExecuteResult(
+        ok=False,
+        job_id=None,
+        bytes_processed=None,
+        billing_tier=None,
+        num_rows=None,
+        preview_rows=None,
+        error_type=error_type,
+        error_message=error_message,
+    )
+
+
+# これより多くのプレビュー行を返すときは Storage Read API（Arrow のストリーミング）で読む。
+# 少量なら読み取りセッションを作るより REST の 1 往復の方が速い。
+_STORAGE_API_MIN_PREVIEW_ROWS = 500
+
+
+@lru_cache(maxsize=1)
+def _get_bqstorage_client() -> "bigquery_storage.BigQueryReadClient":
+    # gRPC / proto の読み込みは重いので、大きなプレビューを読むときまで遅らせる（Slack Gateway の起動を遅くしない）
+    from google.cloud import bigquery_storage
+
+    return bigquery_storage.BigQueryReadClient()
+
+
+def _read_preview_rows_via_storage(
+    result_iter: bigquery.table.RowIterator,
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """Storage Read API の RecordBatch を順に読み、limit 行に達した時点でストリームを打ち切る"""
+    rows: List[Dict[str, Any]] = []
+    stream = result_iter.to_arrow_iterable(bqstorage_client=_get_bqstorage_client())
+    try:
+        for batch in stream:
+            remaining = limit - len(rows)
+            if batch.num_rows >= remaining:
+                rows.extend(batch.slice(0, remaining).to_pylist())
+                break
+            rows.extend(batch.to_pylist())
+    finally:
+        stream.close()
+    return rows
+
+
+def _cancel_job(job: Optional[bigquery.QueryJob]) -> None:
+    """締め切りを過ぎたジョブをサーバー側で止める（ベストエフォート。失敗しても結果には影響させない）"""
+    if job is None:
+        return
+    try:
+        job.cancel()
+    except Exception:
+        pass
+
+
+def _total_bytes_processed(job: bigquery.QueryJob) -> Optional[int]:
+    """
+    完了済みジョブの処理バイト数を、追加の jobs.get を発行せずに読む。
+    jobs.query 経由ではジョブ統計が未取得のことがあるため、初回レスポンスの値で補う。
+    """
+    bytes_processed = job.total_bytes_processed
+    if bytes_processed is None:
+        query_results = getattr(job, "_query_results", None)
+        if query_results is not None:
+            bytes_processed = query_results.total_bytes_processed
+    return bytes_processed
 
 
 def execute_query_with_max_bytes(
@@ -509,45 +817,133 @@ def execute_query_with_max_bytes(
     project_id: Optional[str] = None,
     maximum_bytes_billed: Optional[int] = None,
     preview_rows_limit: int = 50,
+    *,
+    overall_timeout: float = _DEFAULT_DEADLINE_SECONDS,
 ) -> ExecuteResult:
     effective_project_id = _resolve_project_id(project_id)
-    client = bigquery.Client(project=effective_project_id) if effective_project_id else bigquery.Client()
+    cache_key = (
+        _dry_run_cache_key(sql, effective_project_id),
+        maximum_bytes_billed,
+        preview_rows_limit,
+    )
 
-    job_config = bigquery.QueryJobConfig()
-    if maximum_bytes_billed is not None:
-        job_config.maximum_bytes_billed = maximum_bytes_billed
+    owner = False
+    with _EXECUTE_CACHE_LOCK:
+        cached = _EXECUTE_CACHE.get(cache_key)
+        pending = None
+        if cached is None:
+            pending = _EXECUTE_INFLIGHT.get(cache_key)
+            if pending is None:
+                pending = _EXECUTE_INFLIGHT[cache_key] = _PendingExecute()
+                owner = True
+
+    if cached is not None:
+        return _copy_execute_result(cached)
+
+    if not owner:
+        # 先行の実行が終わるまで待ち、その結果を失敗も含めて共有する（失敗時に全員で再実行しない）
+        if not pending.done.wait(overall_timeout):
+            return _failed_execute_result(
+                "TimeoutError",
+                f"query did not finish within {overall_timeout} seconds",
+            )
+        if pending.result is None:
+            return _failed_execute_result(
+                "RuntimeError",
+                "concurrent execution of the same query failed",
+            )
+        return _copy_execute_result(pending.result)
 
     try:
-        job = client.query(sql, job_config=job_config, location=BQ_LOCATION)
-        result_iter = job.result(page_size=preview_rows_limit)
+        pending.result = _execute_query(
+            sql,
+            effective_project_id,
+            maximum_bytes_billed,
+            preview_rows_limit,
+            cache_key,
+            overall_timeout,
+        )
+        return _copy_execute_result(pending.result)
+    finally:
+        with _EXECUTE_CACHE_LOCK:
+            _EXECUTE_INFLIGHT.pop(cache_key, None)
+        pending.done.set()
 
-        preview_rows: List[Dict[str, Any]] = []
-        for i, row in enumerate(result_iter):
-            if i >= preview_rows_limit:
-                break
-            preview_rows.append(dict(row))
 
-        return ExecuteResult(
+def _execute_query(
+    sql: str,
+    effective_project_id: Optional[str],
+    maximum_bytes_billed: Optional[int],
+    preview_rows_limit: int,
+    cache_key: Tuple[str, Optional[int], int],
+    overall_timeout: float,
+) -> ExecuteResult:
+    deadline = time.monotonic() + overall_timeout
+    client = _get_client(effective_project_id)
+    retry = _bq_retry(overall_timeout)
+
+    if maximum_bytes_billed is None:
+        job_config = _EXEC_CFG_DEFAULT
+    else:
+        job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+            maximum_bytes_billed=maximum_bytes_billed,
+        )
+
+    job: Optional[bigquery.QueryJob] = None
+    try:
+        # jobs.query 経由で実行（dry-run は jobs.query 非対応なので jobs.insert のまま）
+        job = client.query(
+            sql,
+            job_config=job_config,
+            location=BQ_LOCATION,
+            api_method=bigquery.enums.QueryApiMethod.QUERY,
+            retry=retry,
+        )
+        # result() の timeout はジョブ完了までの待ち時間の合計なので、全体の締め切りの残りを渡す
+        result_timeout = max(deadline - time.monotonic(), 0.0)
+        if preview_rows_limit > _STORAGE_API_MIN_PREVIEW_ROWS:
+            # max_results を付けると Storage Read API が使われないため、付けずに必要な行数で打ち切る
+            result_iter = job.result(retry=retry, timeout=result_timeout)
+            preview_rows = _read_preview_rows_via_storage(result_iter, preview_rows_limit)
+        else:
+            result_iter = job.result(
+                page_size=preview_rows_limit,
+                max_results=preview_rows_limit,
+                retry=retry,
+                timeout=result_timeout,
+            )
+
+            # max_results で上限行数だけ取得し、Arrow テーブル経由でまとめて dict 化する
+            preview_rows = result_iter.to_arrow(
+                create_bqstorage_client=False,
+            ).to_pylist()
+
+        result = ExecuteResult(
             ok=True,
             job_id=job.job_id,
-            bytes_processed=job.total_bytes_processed,
+            bytes_processed=_total_bytes_processed(job),
             billing_tier=job.billing_tier,
             num_rows=result_iter.total_rows,
             preview_rows=preview_rows,
             error_type=None,
             error_message=None,
         )
+        # キャッシュには呼び出し側へ渡さない元の結果を置き、返すときは常に複製する
+        with _EXECUTE_CACHE_LOCK:
+            _EXECUTE_CACHE[cache_key] = result
+        return result
 
     except gcloud_exceptions.GoogleAPIError as e:
-        return ExecuteResult(
-            ok=False,
-            job_id=None,
-            bytes_processed=None,
-            billing_tier=None,
-            num_rows=None,
-            preview_rows=None,
-            error_type=e.__class__.__name__,
-            error_message=str(e),
+        return _failed_execute_result(e.__class__.__name__, str(e))
+
+    except concurrent.futures.TimeoutError:
+        # 締め切りまでにジョブが終わらなかった（GoogleAPIError ではないので個別に扱う）。
+        # クライアントが待つのをやめてもジョブは実行・課金され続けるので取り消す
+        _cancel_job(job)
+        return _failed_execute_result(
+            "TimeoutError",
+            f"query did not finish within {overall_timeout} seconds",
         )
 
 
@@ -558,14 +954,17 @@ def plan_and_run_query(
     maximum_bytes_billed: Optional[int] = None,
     *,
     default_limit: int = 1000,   # LIMIT 自動付与の既定値
+    overall_timeout: float = _DEFAULT_DEADLINE_SECONDS,  # dry-run + 実行 全体の締め切り（秒）
 ) -> PlanAndRunResult:
     """
-    0) SQL バリデーション（非LLM）
+    0) SQL バリデーション（非LLM）+ SQL パースによる allowlist の事前チェック
     1) dry-run でコスト見積もり
     2) allowlist（参照テーブルが bigquery-public-data.ncaa_basketball のみ）チェック
     3) max_dry_run_bytes 超過なら実行しない
     4) 問題なければ maximum_bytes_billed 付きで本番実行
     """
+    deadline = time.monotonic() + overall_timeout
+
     if not BQ_LOCATION:
         return PlanAndRunResult(
             status="DRY_RUN_ERROR",
@@ -587,10 +986,26 @@ def plan_and_run_query(
 
     sanitized_sql = v.sanitized_sql or sql
 
+    # ★ allowlist の事前チェック（明らかな違反は dry-run の RPC を打たずに拒否）
+    local_violation = _find_disallowed_table_locally(sanitized_sql)
+    if local_violation is not None:
+        return PlanAndRunResult(
+            status="NOT_ALLOWED",
+            sanitized_sql=sanitized_sql,
+            dry_run_bytes=None,
+            execute_result=None,
+            message=(
+                "allowlist 違反のため拒否しました。"
+                f"許可: {ALLOW_PROJECT_ID}.{ALLOW_DATASET_ID} のみ。"
+                f"allowlist 外の参照を検出しました: {local_violation}"
+            ),
+        )
+
     dry = dry_run_query(
         sql=sanitized_sql,
         project_id=project_id,
         max_bytes=max_dry_run_bytes,
+        overall_timeout=overall_timeout,
     )
 
     # dry-run が allowlist 以前に落ちてるケース
@@ -641,6 +1056,7 @@ def plan_and_run_query(
         project_id=project_id,
         maximum_bytes_billed=maximum_bytes_billed,
         preview_rows_limit=50,
+        overall_timeout=max(deadline - time.monotonic(), 0.0),
     )
 
     if not exec_result["ok"]:
@@ -663,3 +1079,63 @@ def plan_and_run_query(
             f"行数 {exec_result['num_rows']} 行。"
         ),
     )
+
+
+async def plan_and_run_query_async(
+    sql: str,
+    project_id: Optional[str] = None,
+    max_dry_run_bytes: Optional[int] = None,
+    maximum_bytes_billed: Optional[int] = None,
+    *,
+    default_limit: int = 1000,
+    overall_timeout: float = _DEFAULT_DEADLINE_SECONDS,
+) -> PlanAndRunResult:
+    """
+    plan_and_run_query の async 版。
+    BigQuery 呼び出しはブロッキングなのでスレッドプールで実行し、イベントループを塞がない。
+    複数クエリは asyncio.gather でまとめて投げると dry-run / 実行の待ち時間が重なる。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None,
+        partial(
+            plan_and_run_query,
+            sql,
+            project_id,
+            max_dry_run_bytes,
+            maximum_bytes_billed,
+            default_limit=default_limit,
+            overall_timeout=overall_timeout,
+        ),
+    )
+
+
+async def plan_and_run_queries_async(
+    sqls: List[str],
+    project_id: Optional[str] = None,
+    max_dry_run_bytes: Optional[int] = None,
+    maximum_bytes_billed: Optional[int] = None,
+    *,
+    default_limit: int = 1000,
+    overall_timeout: float = _DEFAULT_DEADLINE_SECONDS,
+) -> List[PlanAndRunResult]:
+    """
+    複数 SQL をまとめて plan_and_run_query する。
+    各クエリの dry-run / 実行は並行に進むので、待ち時間は最も遅い 1 本分に近づく。
+    戻り値は sqls と同じ順序。
+    """
+    return list(
+        await asyncio.gather(
+            *(
+                plan_and_run_query_async(
+                    sql,
+                    project_id,
+                    max_dry_run_bytes,
+                    maximum_bytes_billed,
+                    default_limit=default_limit,
+                    overall_timeout=overall_timeout,
+                )
+                for sql in sqls
+            )
+        )
+    )
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from typing import Optional
+
+
+def find_first_json_obj(text: str) -> Optional[str]:
+    """
+    最初の "{" から対応する "}" までを 1 パスで切り出す（文字列リテラル内の括弧は数えない）。
+    正規表現のバックトラックを避け、ネストの深さにも制限を設けない。
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    depth = 0
+    in_str = False
+    esc = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
-import json
 import os
 import re
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
-import google.auth
-from google.auth.transport.requests import Request
-import httpx
+import orjson
+
+from _gcp_auth import get_access_token
+from _vertex_http import get_http_client
+
+from ._json import find_first_json_obj
 
 
 def _env(key: str, default: str = "") -> str:
@@ -24,6 +27,7 @@ def _resolve_vertex_location() -> Optional[str]:
     return None
 
 
+@lru_cache(maxsize=1)
 def _load_system_prompt() -> str:
     prompt_path = os.path.join(
         os.path.dirname(__file__),
@@ -35,14 +39,18 @@ def _load_system_prompt() -> str:
         return f.read()
 
 
+_JSON_FENCE_RE = re.compile(r"```json\s*")
+_FENCE_RE = re.compile(r"```\s*")
+
+
 def _extract_json(text: str) -> str:
-    text = re.sub(r"```json\s*", "", text)
-    text = re.sub(r"```\s*", "", text)
+    text = _JSON_FENCE_RE.sub("", text)
+    text = _FENCE_RE.sub("", text)
     text = text.strip()
 
-    json_match = re.search(r"\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}", text, re.DOTALL)
-    if json_match:
-        return json_match.group(0)
+    json_obj = find_first_json_obj(text)
+    if json_obj is not None:
+        return json_obj
     return text
 
 
@@ -55,10 +63,6 @@ def _generate_content(*, system_prompt: str, user_prompt: str, project_id: str)
     temperature = float(_env("KEYWORD_TEMPERATURE", "0"))
     max_tokens = int(_env("KEYWORD_MAX_OUTPUT_TOKENS", "50"))
 
-    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    credentials.refresh(Request())
-    if not credentials.token:
-        raise RuntimeError("failed to obtain access token for Vertex AI")
 
     url = (
         f"https://{location}-aiplatform.googleapis.com/v1/projects/"
@@ -80,27 +84,23 @@ def _generate_content(*, system_prompt: str, user_prompt: str, project_id: str)
             "maxOutputTokens": max_tokens,
         },
     }
-    headers = {"Authorization": f"Bearer {credentials.token}"}
-
-    with httpx.Client(timeout=30.0) as client:
-        resp = client.post(url, json=payload, headers=headers)
-        try:
-            resp.raise_for_status()
-        except Exception as exc:
-            raise RuntimeError(f"Vertex AI error: {resp.status_code} {resp.text[:300]}") from exc
-
-    data = resp.json()
-    candidates = data.get("candidates") or []
-    if not candidates:
-        raise RuntimeError("Vertex AI response missing candidates")
-
-    first = candidates[0] or {}
-    content = first.get("content") or {}
-    parts = content.get("parts") or []
-    if not parts:
-        raise RuntimeError("Vertex AI response missing content parts")
-
-    text = parts[0].get("text")
+    headers = {
+        "Authorization": f"Bearer {get_access_token()}",
+        "Content-Type": "application/json",
+    }
+
+    resp = get_http_client().post(url, content=orjson.dumps(payload), headers=headers)
+    try:
+        resp.raise_for_status()
+    except Exception as exc:
+        raise RuntimeError(f"Vertex AI error: {resp.status_code} {resp.text[:300]}") from exc
+
+    data = orjson.loads(resp.content)
+    try:
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError) as exc:
+        raise RuntimeError(f"Vertex AI response malformed: {exc!r}") from exc
+
     if not text:
         raise RuntimeError("Vertex AI response missing text")
 
@@ -123,7 +123,7 @@ def extract_keywords(user_request: str, *, project_id: str) -> Dict[str, Any]:
     )
     json_text = _extract_json(response_text)
     try:
-        payload = json.loads(json_text)
+        payload = orjson.loads(json_text)
     except Exception:
         payload = {}
 
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
-import json
 import os
 import re
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
-import google.auth
-from google.auth.transport.requests import Request
-import httpx
+import orjson
+
+from _gcp_auth import get_access_token
+from _vertex_http import get_http_client
+
+from ._json import find_first_json_obj
 
 
 def _env(key: str, default: str = "") -> str:
@@ -24,6 +27,7 @@ def _resolve_vertex_location() -> Optional[str]:
     return None
 
 
+@lru_cache(maxsize=1)
 def _load_system_prompt() -> str:
     prompt_path = os.path.join(
         os.path.dirname(__file__),
@@ -35,28 +39,33 @@ def _load_system_prompt() -> str:
         return f.read()
 
 
+_JSON_FENCE_RE = re.compile(r"```json\s*")
+_FENCE_RE = re.compile(r"```\s*")
+_SQL_BLOCK_RE = re.compile(r"```sql\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
 def _extract_json(text: str) -> str:
-    text = re.sub(r"```json\s*", "", text)
-    text = re.sub(r"```\s*", "", text)
+    text = _JSON_FENCE_RE.sub("", text)
+    text = _FENCE_RE.sub("", text)
     text = text.strip()
 
-    json_match = re.search(r"\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}", text, re.DOTALL)
-    if json_match:
-        return json_match.group(0)
+    json_obj = find_first_json_obj(text)
+    if json_obj is not None:
+        return json_obj
     return text
 
 
 def _extract_sql(text: str) -> str:
     json_text = _extract_json(text)
     try:
-        payload = json.loads(json_text)
+        payload = orjson.loads(json_text)
     except Exception:
         payload = None
 
     if isinstance(payload, dict) and isinstance(payload.get("sql"), str):
         return payload["sql"].strip()
 
-    sql_block = re.search(r"```sql\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    sql_block = _SQL_BLOCK_RE.search(text)
     if sql_block:
         return sql_block.group(1).strip()
 
@@ -77,10 +86,6 @@ def _generate_content(
     temperature = float(_env("LLM_TEMPERATURE", "0.8"))
     max_tokens = int(_env("LLM_MAX_OUTPUT_TOKENS", "1024"))
 
-    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    credentials.refresh(Request())
-    if not credentials.token:
-        raise RuntimeError("failed to obtain access token for Vertex AI")
 
     url = (
         f"https://{location}-aiplatform.googleapis.com/v1/projects/"
@@ -102,27 +107,23 @@ def _generate_content(
             "maxOutputTokens": max_tokens,
         },
     }
-    headers = {"Authorization": f"Bearer {credentials.token}"}
-
-    with httpx.Client(timeout=30.0) as client:
-        resp = client.post(url, json=payload, headers=headers)
-        try:
-            resp.raise_for_status()
-        except Exception as exc:
-            raise RuntimeError(f"Vertex AI error: {resp.status_code} {resp.text[:300]}") from exc
-
-    data = resp.json()
-    candidates = data.get("candidates") or []
-    if not candidates:
-        raise RuntimeError("Vertex AI response missing candidates")
-
-    first = candidates[0] or {}
-    content = first.get("content") or {}
-    parts = content.get("parts") or []
-    if not parts:
-        raise RuntimeError("Vertex AI response missing content parts")
-
-    text = parts[0].get("text")
+    headers = {
+        "Authorization": f"Bearer {get_access_token()}",
+        "Content-Type": "application/json",
+    }
+
+    resp = get_http_client().post(url, content=orjson.dumps(payload), headers=headers)
+    try:
+        resp.raise_for_status()
+    except Exception as exc:
+        raise RuntimeError(f"Vertex AI error: {resp.status_code} {resp.text[:300]}") from exc
+
+    data = orjson.loads(resp.content)
+    try:
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError) as exc:
+        raise RuntimeError(f"Vertex AI response malformed: {exc!r}") from exc
+
     if not text:
         raise RuntimeError("Vertex AI response missing text")
 
@@ -163,7 +164,7 @@ def generate_sql_from_search(
         "semantic_search_items": deduped_items,
         "semantic_search_by_keyword": search_results,
     }
-    user_prompt = json.dumps(user_payload, ensure_ascii=False, indent=2)
+    user_prompt = orjson.dumps(user_payload, option=orjson.OPT_INDENT_2).decode("utf-8")
     response_text = _generate_content(
         system_prompt=system_prompt,
         user_prompt=user_prompt,
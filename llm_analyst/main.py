@@ -17,6 +17,9 @@
 #   EMBEDDING_META_TABLE   : 例 "kentaro-388002.meta.embedding_meta_data"
 #   EMBEDDING_COLUMN       : 例 "embedding"
 #   EMBEDDING_TOP_K        : int、デフォルト 8
+#   BQ_POOL                : int、デフォルト 16（BigQuery / Vertex AI 呼び出し用スレッド数）
+#   SEMANTIC_CACHE_TAU     : float、デフォルト 0.95（この類似度以上の質問は生成済み SQL を再利用）
+#   SEMANTIC_CACHE_TTL_SECONDS : int、デフォルト 3600
 #
 # ローカル起動:
 #   uvicorn main:app --host 0.0.0.0 --port 8080
@@ -24,25 +27,37 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import hashlib
 import hmac
-import json
 import logging
 import os
 import re
+import secrets
+import sys
 import time
-import uuid
-from typing import Any, Dict
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, TypeVar
 
 import httpx
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-
-from bq_tools import search_embedding_meta_data
+import orjson
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
+
+import semantic_cache
+from bq_tools import (
+    EmbeddingHTTPError,
+    embedding_batch_size,
+    generate_text_embedding,
+    generate_text_embeddings,
+    search_embedding_meta_data,
+    warmup,
+)
 from llm import extract_keywords, generate_sql_from_search
 
-app = FastAPI()
-
 logger = logging.getLogger("gateway")
 logger.setLevel(logging.INFO)
 
@@ -54,38 +69,136 @@ def _env(key: str, default: str = "") -> str:
     return os.getenv(key, default)
 
 
+# 環境変数は稼働中のインスタンスでは変わらないので、import 時に 1 回だけ解決する
+_PROJECT_ID: str | None = _env("PROJECT_ID") or _env("GOOGLE_CLOUD_PROJECT") or None
+_SLACK_BOT_TOKEN = _env("SLACK_BOT_TOKEN")
+_SLACK_AUTH_HEADERS = {"Authorization": f"Bearer {_SLACK_BOT_TOKEN}"}
+
+
+# ----------------------------
+# 構造化ログ
+# ----------------------------
+# Cloud Logging は stdout の JSON 行を構造化ログとして扱う。
+# リクエスト処理中は行をキューに積むだけにし、書き出しはバックグラウンドでまとめて行う
+_STDOUT = sys.stdout.buffer
+_LOG_BATCH_WINDOW_SECONDS = 0.25
+_LOG_MAX_BATCH = 64
+_LOG_QUEUE_MAX_SIZE = 4096
+
+
+class _LogWriter:
+    """
+    JSON 行を短い時間窓ごとにまとめ、1 回の write + flush で stdout に書き出す。
+    stdout が詰まってもリクエスト処理は待たせず、キューが溢れた分は捨てる。
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=_LOG_QUEUE_MAX_SIZE)
+        self._worker: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        # 終了時に残っている行は捨てずに書き出す
+        lines = []
+        while not self._queue.empty():
+            lines.append(self._queue.get_nowait())
+        self._write(lines)
+
+    def write(self, line: bytes) -> None:
+        # 起動前・終了後はキューを使わず、その場で書き出す
+        if self._worker is None:
+            self._write([line])
+            return
+        with contextlib.suppress(asyncio.QueueFull):
+            self._queue.put_nowait(line)
 
-def _resolve_project_id() -> str | None:
-    data_project = _env("PROJECT_ID", "")
-    default_project = _env("GOOGLE_CLOUD_PROJECT", "")
-    return data_project or default_project or None
+    async def _loop(self) -> None:
+        while True:
+            lines = [await self._queue.get()]
+            try:
+                await asyncio.sleep(_LOG_BATCH_WINDOW_SECONDS)
+                while len(lines) < _LOG_MAX_BATCH and not self._queue.empty():
+                    lines.append(self._queue.get_nowait())
+            finally:
+                # stop() で時間窓の途中にキャンセルされても、取り出し済みの行は書き出す
+                self._write(lines)
+
+    @staticmethod
+    def _write(lines: list[bytes]) -> None:
+        if lines:
+            _STDOUT.write(b"".join(lines))
+            _STDOUT.flush()
+
+
+_log_writer = _LogWriter()
 
 
 def _log_json(payload: Dict[str, Any]) -> None:
-    print(json.dumps(payload, ensure_ascii=False))
+    # 1 行の JSON を bytes のまま作ってキューに積む（イベントループ上から呼ぶこと）
+    _log_writer.write(orjson.dumps(payload, option=orjson.OPT_APPEND_NEWLINE))
+
+
+# ----------------------------
+# ブロッキング処理の実行
+# ----------------------------
+# BigQuery / Vertex AI 呼び出しは共有のスレッドプールで実行する。
+# スレッドはほぼネットワーク I/O 待ちなので CPU 数ではなく同時実行数で決める。
+# 既定は同時実行ラン数（_MAX_CONCURRENT_RUNS = 16）と揃え、ランがプールの空き待ちで詰まらないようにする
+try:
+    _POOL_SIZE = int(_env("BQ_POOL", "16"))
+except ValueError:
+    _POOL_SIZE = 16
+_EXECUTOR = ThreadPoolExecutor(max_workers=_POOL_SIZE, thread_name_prefix="bq")
+
+_T = TypeVar("_T")
+
+
+async def _run(func: Callable[..., _T], /, *args: Any, **kwargs: Any) -> _T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, partial(func, *args, **kwargs))
 
 
 # ----------------------------
 # Slack 署名検証
 # ----------------------------
+# Signing Secret はプロセス中に変わらないので、bytes 化と HMAC の鍵スケジュールを import 時に 1 回だけ行う
+_SIGNING_SECRET_BYTES = _env("SLACK_SIGNING_SECRET", "").encode("utf-8")
+_SIGNING_MAC_BASE = hmac.new(_SIGNING_SECRET_BYTES, b"v0:", hashlib.sha256)
+
+# "v0=" + SHA-256 の 16 進表記（64 文字）
+_SLACK_SIGNATURE_LEN = 3 + 64
+
+
 def _verify_slack_signature(request: Request, body: bytes) -> None:
-    secret = _env("SLACK_SIGNING_SECRET", "")
+    secret = _SIGNING_SECRET_BYTES
     sig = request.headers.get("X-Slack-Signature")
     ts = request.headers.get("X-Slack-Request-Timestamp")
 
-    logger.info(
-        "slack_verify has_secret=%s has_sig=%s has_ts=%s body_len=%d content_type=%s",
-        bool(secret),
-        bool(sig),
-        bool(ts),
-        len(body),
-        request.headers.get("content-type"),
-    )
+    # 診断用のログは DEBUG のときだけ（毎リクエストの整形・出力を避ける）
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "slack_verify has_secret=%s has_sig=%s has_ts=%s body_len=%d content_type=%s",
+            bool(secret),
+            bool(sig),
+            bool(ts),
+            len(body),
+            request.headers.get("content-type"),
+        )
 
     if not secret:
         raise HTTPException(status_code=401, detail="SLACK_SIGNING_SECRET empty")
     if not sig or not ts:
         raise HTTPException(status_code=401, detail="Missing Slack signature headers")
+    # 形式が明らかに不正な署名は本文全体の HMAC を計算する前に拒否する
+    if len(sig) != _SLACK_SIGNATURE_LEN or not sig.startswith("v0="):
+        raise HTTPException(status_code=401, detail="Invalid Slack signature format")
 
     try:
         ts_i = int(ts)
@@ -94,17 +207,23 @@ def _verify_slack_signature(request: Request, body: bytes) -> None:
 
     now = int(time.time())
     diff = abs(now - ts_i)
-    logger.info("slack_verify now=%d ts=%d diff=%d", now, ts_i, diff)
+    logger.debug("slack_verify now=%d ts=%d diff=%d", now, ts_i, diff)
     if diff > 60 * 5:
         raise HTTPException(status_code=401, detail="Stale Slack request")
 
-    basestring = f"v0:{ts}:".encode("utf-8") + body
-    digest = hmac.new(secret.encode("utf-8"), basestring, hashlib.sha256).hexdigest()
-    expected = f"v0={digest}"
+    # "v0:{ts}:" + body を連結せず、HMAC に順に流し込む（本文サイズのコピーを作らない）
+    mac = _SIGNING_MAC_BASE.copy()
+    mac.update(ts.encode("utf-8"))
+    mac.update(b":")
+    mac.update(body)
 
-    logger.info("slack_verify sig_prefix=%s expected_prefix=%s", sig[:12], expected[:12])
+    # 16 進文字列同士ではなく、生の 32 バイト同士を定数時間で比較する
+    try:
+        received = bytes.fromhex(sig[3:])
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid Slack signature format")
 
-    if not hmac.compare_digest(expected, sig):
+    if not hmac.compare_digest(mac.digest(), received):
         raise HTTPException(status_code=401, detail="Invalid Slack signature")
 
 
@@ -112,17 +231,14 @@ def _verify_slack_signature(request: Request, body: bytes) -> None:
 # Slack メッセージ送信ヘルパー
 # ----------------------------
 async def _slack_api_post(method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    token = _env("SLACK_BOT_TOKEN", "")
-    if not token:
+    if not _SLACK_BOT_TOKEN:
         raise RuntimeError("SLACK_BOT_TOKEN not set")
 
-    url = f"https://slack.com/api/{method}"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.post(
-            url,
-            headers={"Authorization": f"Bearer {token}"},
-            json=payload,
-        )
+    r = await app.state.slack_client.post(
+        method,
+        headers=_SLACK_AUTH_HEADERS,
+        json=payload,
+    )
 
     # HTTPエラー（稀。Slackは通常200で ok:false を返す）
     try:
@@ -170,26 +286,194 @@ async def _post_ephemeral(channel: str, user: str, text: str) -> None:
 # ----------------------------
 # クエリ抽出
 # ----------------------------
+_MENTION_RE = re.compile(r"^<@[^>]+>\s*")
+
+
 def _extract_query_from_app_mention(text: str) -> str:
     # 先頭の "<@UXXXX>" メンションを除去
-    t = (text or "").strip()
-    t = re.sub(r"^<@[^>]+>\s*", "", t).strip()
-    return t
+    return _MENTION_RE.sub("", (text or "").strip()).strip()
+
+
+# ----------------------------
+# 埋め込みのマイクロバッチ
+# ----------------------------
+_EMBED_BATCH_WINDOW_SECONDS = 0.02
+_EMBED_MAX_BATCH = 64
+
+
+class _EmbeddingBatcher:
+    """
+    短い時間窓に届いた埋め込み要求をまとめ、generate_text_embeddings 1 回で処理する。
+    同時に来た複数の Slack メンションやキーワードの埋め込みが 1 往復にまとまる。
+    モデルが 1 件ずつしか受け付けない場合は、まとめても順番に送るだけなので使わない。
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[tuple[str, str, asyncio.Future]] = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
+        self._flushes: set[asyncio.Task] = set()
+        self._batching = embedding_batch_size() > 1
+
+    def start(self) -> None:
+        if self._batching:
+            self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        # まだ送っていない要求は失敗させ、送信中のものは応答を待って解決させる
+        pending = []
+        while not self._queue.empty():
+            text, _, fut = self._queue.get_nowait()
+            pending.append((text, fut))
+        self._fail(pending, RuntimeError("embedding batcher stopped"))
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def embed(self, text: str, project_id: str) -> list[float]:
+        # 空テキストが混ざるとバッチ全体が失敗するので、ここで個別に弾く
+        if not text.strip():
+            raise ValueError("text is empty")
+        if self._worker is None:
+            # バッチを使わない（または停止中の）ときは 1 件ずつ並行に取得する
+            return await _run(generate_text_embedding, text, project_id=project_id)
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, project_id, fut))
+        return await fut
+
+    async def _loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                await asyncio.sleep(_EMBED_BATCH_WINDOW_SECONDS)
+            except asyncio.CancelledError:
+                # 取り出し済みの要求を宙に浮かせない
+                self._fail(
+                    [(text, fut) for text, _, fut in batch],
+                    RuntimeError("embedding batcher stopped"),
+                )
+                raise
+            while len(batch) < _EMBED_MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            by_project: dict[str, list[tuple[str, asyncio.Future]]] = {}
+            for text, project_id, fut in batch:
+                by_project.setdefault(project_id, []).append((text, fut))
+
+            # Vertex AI の応答を待つ間も次の時間窓の要求を受け付ける
+            for project_id, items in by_project.items():
+                task = asyncio.create_task(self._flush(project_id, items))
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, project_id: str, items: list[tuple[str, asyncio.Future]]) -> None:
+        try:
+            vectors = await _run(
+                generate_text_embeddings,
+                [text for text, _ in items],
+                project_id=project_id,
+            )
+        except Exception as e:
+            # 429（クォータ超過）や 5xx は分けて送っても同じく失敗し、要求数を増やすだけなのでまとめて失敗させる
+            if not _is_per_input_error(e):
+                self._fail(items, e)
+                return
+            # 入力に起因する 4xx は 1 件の失敗で他の利用者の要求まで失敗させないよう、1 件ずつ取り直す
+            results = await asyncio.gather(
+                *(_run(generate_text_embedding, text, project_id=project_id) for text, _ in items),
+                return_exceptions=True,
+            )
+            for (_, fut), result in zip(items, results):
+                if fut.done():
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                elif isinstance(result, BaseException):
+                    fut.set_exception(RuntimeError("embedding request cancelled"))
+                else:
+                    fut.set_result(result)
+            return
+
+        for (_, fut), vec in zip(items, vectors):
+            if not fut.done():
+                fut.set_result(vec)
+
+    @staticmethod
+    def _fail(items: list[tuple[str, asyncio.Future]], exc: Exception) -> None:
+        for _, fut in items:
+            if not fut.done():
+                fut.set_exception(exc)
+
+
+def _is_per_input_error(e: Exception) -> bool:
+    return (
+        isinstance(e, EmbeddingHTTPError)
+        and 400 <= e.status_code < 500
+        and e.status_code != 429
+    )
+
+
+_embedder = _EmbeddingBatcher()
 
 
 # ----------------------------
 # 関連メタデータ検索 + 返信
 # ----------------------------
+def _format_sql_reply(sql: str, search_results: list[Dict[str, Any]]) -> str:
+    return (
+        "generated SQL:\n"
+        f"```sql\n{sql}\n```\n"
+        "vector search results:\n"
+        f"```{orjson.dumps(search_results, option=orjson.OPT_INDENT_2).decode('utf-8')}```"
+    )
+
+
+# 処理中の質問文 -> 生成結果（失敗時は None）。同じ質問の同時実行をまとめる
+_INFLIGHT: Dict[str, "asyncio.Future[semantic_cache.SemanticCacheEntry | None]"] = {}
+
+# 同時に処理する質問数の上限。スレッドプールの前に無制限に積まず、入口で待たせる。
+# 空きを待っても取れなければ混雑を返信して打ち切る
+_MAX_CONCURRENT_RUNS = 16
+_RUN_ACQUIRE_TIMEOUT_SECONDS = 10.0
+_RUN_SEMAPHORE = asyncio.Semaphore(_MAX_CONCURRENT_RUNS)
+
+
+async def _handle_mention(channel: str, user: str, thread_ts: str, query: str) -> None:
+    try:
+        await asyncio.wait_for(_RUN_SEMAPHORE.acquire(), timeout=_RUN_ACQUIRE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        await _post_message(
+            channel,
+            "現在混み合っています。しばらくしてから再度お試しください。",
+            thread_ts=thread_ts,
+        )
+        _log_json({
+            "event": "semantic_search",
+            "status": "BUSY",
+            "slack_channel": channel,
+            "slack_user": user,
+        })
+        return
+
+    try:
+        await _run_semantic_search_and_generate_sql(channel, user, thread_ts, query)
+    finally:
+        _RUN_SEMAPHORE.release()
+
+
 async def _run_semantic_search_and_generate_sql(
     channel: str,
     user: str,
     thread_ts: str,
     query: str,
 ) -> None:
-    run_id = uuid.uuid4().hex
-    start = time.time()
+    run_id = secrets.token_hex(16)
+    start = time.perf_counter_ns()
 
-    project_id = _resolve_project_id()
+    project_id = _PROJECT_ID
     if not project_id:
         await _post_message(
             channel,
@@ -206,8 +490,105 @@ async def _run_semantic_search_and_generate_sql(
         })
         return
 
+    # ★ 意味的に近い過去の質問があれば、キーワード抽出・検索・SQL 生成をすべて省略する
+    query_embedding: list[float] | None = None
+    try:
+        query_embedding = await _embedder.embed(query, project_id)
+    except Exception as e:
+        # キャッシュが使えないだけなので通常の経路で続行する
+        logger.warning(
+            "semantic_cache_embedding_failed run_id=%s error_type=%s error=%s",
+            run_id,
+            type(e).__name__,
+            e,
+        )
+
+    if query_embedding is not None:
+        cached = semantic_cache.lookup(query_embedding)
+        if cached is not None:
+            elapsed_ms = (time.perf_counter_ns() - start) // 1_000_000
+            _log_json({
+                "event": "sql_generation",
+                "run_id": run_id,
+                "status": "CACHE_HIT",
+                "elapsed_ms": elapsed_ms,
+                "slack_channel": channel,
+                "slack_user": user,
+            })
+            await _post_message(
+                channel,
+                _format_sql_reply(cached["sql"], cached["search_results"]),
+                thread_ts=thread_ts,
+            )
+            return
+
+    # ★ 同じ質問を処理中なら、その結果を待って返信する（連投や複数人の同時質問で二重に LLM を呼ばない）
+    # 先行が失敗した場合も結果（失敗）を共有し、待っていた全員で一斉にやり直さない
+    pending = _INFLIGHT.get(query)
+    if pending is not None:
+        shared = await asyncio.shield(pending)
+        elapsed_ms = (time.perf_counter_ns() - start) // 1_000_000
+        _log_json({
+            "event": "sql_generation",
+            "run_id": run_id,
+            "status": "COALESCED" if shared is not None else "COALESCED_ERROR",
+            "elapsed_ms": elapsed_ms,
+            "slack_channel": channel,
+            "slack_user": user,
+        })
+        if shared is None:
+            await _post_message(
+                channel,
+                "同じ質問の処理中にエラーが発生しました。しばらくしてから再度お試しください。",
+                thread_ts=thread_ts,
+            )
+            return
+        await _post_message(
+            channel,
+            _format_sql_reply(shared["sql"], shared["search_results"]),
+            thread_ts=thread_ts,
+        )
+        return
+
+    fut: asyncio.Future[semantic_cache.SemanticCacheEntry | None] = (
+        asyncio.get_running_loop().create_future()
+    )
+    _INFLIGHT[query] = fut
+    entry: semantic_cache.SemanticCacheEntry | None = None
     try:
-        keyword_payload = await asyncio.to_thread(
+        entry = await _search_and_generate_sql(
+            channel,
+            user,
+            thread_ts,
+            query,
+            project_id=project_id,
+            run_id=run_id,
+            start=start,
+            query_embedding=query_embedding,
+        )
+    finally:
+        if _INFLIGHT.get(query) is fut:
+            del _INFLIGHT[query]
+        fut.set_result(entry)
+
+
+async def _search_and_generate_sql(
+    channel: str,
+    user: str,
+    thread_ts: str,
+    query: str,
+    *,
+    project_id: str,
+    run_id: str,
+    start: int,
+    query_embedding: list[float] | None,
+) -> semantic_cache.SemanticCacheEntry | None:
+    """
+    キーワード抽出 → メタデータ検索 → SQL 生成を行い、結果をスレッドに返信する。
+    途中で失敗した場合はエラーを返信して None を返す。
+    """
+    try:
+        keyword_payload = await _run(
             extract_keywords,
             query,
             project_id=project_id,
@@ -227,7 +608,7 @@ async def _run_semantic_search_and_generate_sql(
             "slack_channel": channel,
             "slack_user": user,
         })
-        return
+        return None
 
     keywords: list[str] = []
     for key in ("metrics", "dimensions"):
@@ -256,36 +637,42 @@ async def _run_semantic_search_and_generate_sql(
     if not deduped_keywords:
         deduped_keywords = [query]
 
-    search_results = []
-    for kw in deduped_keywords:
-        try:
-            result = await asyncio.to_thread(
-                search_embedding_meta_data,
-                text=kw,
-                project_id=project_id,
-                top_k=3,
-            )
-        except Exception as e:
-            await _post_message(
-                channel,
-                f"Semantic search error: {type(e).__name__}: {e}",
-                thread_ts=thread_ts,
-            )
-            _log_json({
-                "event": "semantic_search",
-                "run_id": run_id,
-                "status": "UNHANDLED_ERROR",
-                "error_type": type(e).__name__,
-                "error_message": str(e),
-                "slack_channel": channel,
-                "slack_user": user,
-            })
-            return
+    async def _search(kw: str) -> Dict[str, Any]:
+        # 埋め込みはバッチャーで他のキーワードとまとめて取得し、検索はキーワードごとに並行に投げる
+        kw_embedding = await _embedder.embed(kw, project_id)
+        result = await _run(
+            search_embedding_meta_data,
+            text=kw,
+            project_id=project_id,
+            top_k=3,
+            query_embedding=kw_embedding,
+        )
         result["keyword"] = kw
-        search_results.append(result)
+        return result
 
     try:
-        sql = await asyncio.to_thread(
+        search_results = list(
+            await asyncio.gather(*(_search(kw) for kw in deduped_keywords))
+        )
+    except Exception as e:
+        await _post_message(
+            channel,
+            f"Semantic search error: {type(e).__name__}: {e}",
+            thread_ts=thread_ts,
+        )
+        _log_json({
+            "event": "semantic_search",
+            "run_id": run_id,
+            "status": "UNHANDLED_ERROR",
+            "error_type": type(e).__name__,
+            "error_message": str(e),
+            "slack_channel": channel,
+            "slack_user": user,
+        })
+        return None
+
+    try:
+        sql = await _run(
             generate_sql_from_search,
             query,
             search_results,
@@ -306,9 +693,13 @@ async def _run_semantic_search_and_generate_sql(
             "slack_channel": channel,
             "slack_user": user,
         })
-        return
+        return None
 
-    elapsed_ms = int((time.time() - start) * 1000)
+    entry = semantic_cache.SemanticCacheEntry(sql=sql, search_results=search_results)
+    if query_embedding is not None:
+        semantic_cache.store(query, query_embedding, entry)
+
+    elapsed_ms = (time.perf_counter_ns() - start) // 1_000_000
     _log_json({
         "event": "sql_generation",
         "run_id": run_id,
@@ -320,19 +711,91 @@ async def _run_semantic_search_and_generate_sql(
 
     await _post_message(
         channel,
-        (
-            "generated SQL:\n"
-            f"```sql\n{sql}\n```\n"
-            "vector search results:\n"
-            f"```{json.dumps(search_results, ensure_ascii=False, indent=2)}```"
-        ),
+        _format_sql_reply(sql, search_results),
         thread_ts=thread_ts,
     )
+    return entry
+
+
+# ----------------------------
+# 起動・終了処理
+# ----------------------------
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _warmup() -> None:
+    try:
+        await _run(warmup, _PROJECT_ID)
+        logger.info("warmup done")
+    except Exception as e:
+        logger.warning("warmup failed error_type=%s error=%s", type(e).__name__, e)
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Slack API への接続はプロセス内で使い回す（返信ごとの TCP / TLS ハンドシェイクを省く）
+    app.state.slack_client = httpx.AsyncClient(
+        base_url="https://slack.com/api/",
+        timeout=10.0,
+        limits=httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=50,
+            keepalive_expiry=30.0,
+        ),
+        http2=True,
+    )
+
+    # 未設定でもヘルスチェックには応答する（リクエスト時に Slack へエラーを返す）が、起動時に気付けるよう警告する
+    if not _PROJECT_ID:
+        logger.warning("PROJECT_ID / GOOGLE_CLOUD_PROJECT not set")
+
+    _log_writer.start()
+    _embedder.start()
+
+    # 起動（ヘルスチェック応答）を待たせないよう、バックグラウンドで実行する
+    task = asyncio.create_task(_warmup())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    try:
+        yield
+    finally:
+        await _embedder.stop()
+        await app.state.slack_client.aclose()
+        await _log_writer.stop()
+        _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=_lifespan)
 
 
 # ----------------------------
 # Slack Events エンドポイント
 # ----------------------------
+# 処理済み event_id -> 受信時刻（monotonic）。Slack の再送や重複配信で同じ処理を二重に走らせない
+_SEEN_EVENT_TTL_SECONDS = 60.0
+_SEEN_EVENT_MAX_SIZE = 2048
+_SEEN: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _is_duplicate_event(event_id: str, ttl: float = _SEEN_EVENT_TTL_SECONDS) -> bool:
+    now = time.monotonic()
+    # 挿入順 = 受信時刻順なので、先頭から期限切れのものだけを捨てればよい
+    while _SEEN:
+        oldest_seen = next(iter(_SEEN.values()))
+        if now - oldest_seen < ttl:
+            break
+        _SEEN.popitem(last=False)
+
+    if event_id in _SEEN:
+        return True
+    _SEEN[event_id] = now
+    # イベントが集中しても TTL 内に件数が膨らみ過ぎないよう、古いものから捨てる
+    while len(_SEEN) > _SEEN_EVENT_MAX_SIZE:
+        _SEEN.popitem(last=False)
+    return False
+
+
 @app.post("/slack/events")
 async def slack_events(req: Request, bg: BackgroundTasks):
     """
@@ -342,31 +805,36 @@ async def slack_events(req: Request, bg: BackgroundTasks):
     body = await req.body()
     _verify_slack_signature(req, body)
 
-    # raw bytes から安全に JSON をパース
+    # raw bytes のまま JSON をパース（decode の中間文字列を作らない）
     try:
-        payload = json.loads(body.decode("utf-8"))
+        payload = orjson.loads(body)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
     # URL Verification: challenge を返す
     if payload.get("type") == "url_verification":
-        return JSONResponse({"challenge": payload.get("challenge", "")})
+        return ORJSONResponse({"challenge": payload.get("challenge", "")})
 
     # Slack の再送: ACK のみ返す（重複実行を回避）
     if req.headers.get("x-slack-retry-num"):
-        return JSONResponse({"ok": True})
+        return ORJSONResponse({"ok": True})
 
     if payload.get("type") != "event_callback":
-        return JSONResponse({"ok": True})
+        return ORJSONResponse({"ok": True})
+
+    # 同じ event_id が再送ヘッダなしで重複して届くことがあるので、ここでも弾く
+    event_id = payload.get("event_id")
+    if event_id and _is_duplicate_event(str(event_id)):
+        return ORJSONResponse({"ok": True})
 
     event = payload.get("event") or {}
 
     # ループ防止
     if event.get("bot_id") or event.get("subtype") == "bot_message":
-        return JSONResponse({"ok": True})
+        return ORJSONResponse({"ok": True})
 
     if event.get("type") != "app_mention":
-        return JSONResponse({"ok": True})
+        return ORJSONResponse({"ok": True})
 
     channel = str(event.get("channel") or "")
     user = str(event.get("user") or "")
@@ -376,15 +844,20 @@ async def slack_events(req: Request, bg: BackgroundTasks):
     query = _extract_query_from_app_mention(text)
     if not query:
         bg.add_task(_post_ephemeral, channel, user, "Usage: @bot <自然言語クエリ>")
-        return JSONResponse({"ok": True})
+        return ORJSONResponse({"ok": True})
 
-    await _post_ephemeral(channel, user, "受け付けました。検索を開始します。")
+    # 受付通知も Slack API の往復になるので ACK の後に回す（BackgroundTasks は登録順に実行される）
+    bg.add_task(_post_ephemeral, channel, user, "受け付けました。検索を開始します。")
 
     # バックグラウンドで実行
-    bg.add_task(_run_semantic_search_and_generate_sql, channel, user, thread_ts, query)
-    return JSONResponse({"ok": True})
+    bg.add_task(_handle_mention, channel, user, thread_ts, query)
+    return ORJSONResponse({"ok": True})
+
+
+# ヘルスチェックは頻繁に叩かれるので、エンコード済みの固定レスポンスを返す
+_HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
 
 
 @app.get("/health")
-async def health() -> Dict[str, str]:
-    return {"status": "ok"}
+async def health() -> Response:
+    return _HEALTH_RESPONSE
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from typing_extensions import TypedDict
+
+
+# ---------------------------
+# Env
+# ---------------------------
+
+# 質問文の埋め込みのコサイン類似度がこの値以上なら「同じ質問」とみなして再利用する
+try:
+    SEMANTIC_CACHE_TAU = float(os.getenv("SEMANTIC_CACHE_TAU", "0.95"))
+except ValueError:
+    SEMANTIC_CACHE_TAU = 0.95
+try:
+    SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+except ValueError:
+    SEMANTIC_CACHE_TTL_SECONDS = 3600
+
+_SEMANTIC_CACHE_MAX_SIZE = 512
+
+
+class SemanticCacheEntry(TypedDict):
+    sql: str
+    search_results: List[Dict[str, Any]]
+
+
+# 埋め込みは単位ベクトルに正規化して (_SEMANTIC_CACHE_MAX_SIZE, 次元) の連続した float32 行列に
+# 行ごとに格納する。検索は行列 x ベクトルの 1 回の積（BLAS の GEMV）で全件のコサイン類似度が求まる。
+# 行（スロット）は件数上限と TTL で再利用し、満杯なら最も長く使われていない質問のスロットを空ける。
+_matrix: Optional[np.ndarray] = None                          # 初回 store で次元が分かってから確保
+_stored_at = np.full(_SEMANTIC_CACHE_MAX_SIZE, -np.inf)        # スロットごとの保存時刻（-inf は空き）
+_keys: List[Optional[str]] = [None] * _SEMANTIC_CACHE_MAX_SIZE
+_entries: List[Optional[SemanticCacheEntry]] = [None] * _SEMANTIC_CACHE_MAX_SIZE
+_slots: "OrderedDict[str, int]" = OrderedDict()               # 質問文 -> スロット（LRU 順）
+_LOCK = threading.Lock()
+
+
+def _normalize(embedding: Sequence[float]) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def _expired(now: float) -> np.ndarray:
+    return now - _stored_at >= SEMANTIC_CACHE_TTL_SECONDS
+
+
+def _reset(dim: int) -> None:
+    """次元が変わった（モデル切り替え等）ら、古い埋め込みとは比較できないので作り直す"""
+    global _matrix
+    _matrix = np.zeros((_SEMANTIC_CACHE_MAX_SIZE, dim), dtype=np.float32)
+    _stored_at.fill(-np.inf)
+    _keys[:] = [None] * _SEMANTIC_CACHE_MAX_SIZE
+    _entries[:] = [None] * _SEMANTIC_CACHE_MAX_SIZE
+    _slots.clear()
+
+
+def _take_slot(now: float) -> int:
+    free = np.flatnonzero(_expired(now))
+    if free.size:
+        slot = int(free[0])
+        old_key = _keys[slot]
+        if old_key is not None:
+            _slots.pop(old_key, None)
+    else:
+        _, slot = _slots.popitem(last=False)
+    return slot
+
+
+def lookup(embedding: Sequence[float]) -> Optional[SemanticCacheEntry]:
+    """
+    埋め込みが最も近い過去の質問を探し、類似度が SEMANTIC_CACHE_TAU 以上ならその結果を返す。
+    ヒットしなければ None。
+    """
+    query = _normalize(embedding)
+
+    with _LOCK:
+        if _matrix is None or _matrix.shape[1] != query.shape[0]:
+            return None
+
+        scores = _matrix @ query
+        scores[_expired(time.monotonic())] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < SEMANTIC_CACHE_TAU:
+            return None
+
+        key = _keys[best]
+        if key is not None:
+            _slots.move_to_end(key)
+        return _entries[best]
+
+
+def store(query: str, embedding: Sequence[float], entry: SemanticCacheEntry) -> None:
+    vec = _normalize(embedding)
+
+    with _LOCK:
+        if _matrix is None or _matrix.shape[1] != vec.shape[0]:
+            _reset(vec.shape[0])
+
+        now = time.monotonic()
+        slot = _slots.pop(query, None)
+        if slot is None:
+            slot = _take_slot(now)
+
+        _matrix[slot] = vec
+        _stored_at[slot] = now
+        _keys[slot] = query
+        _entries[slot] = entry
+        _slots[query] = slot
@@ -1,7 +1,9 @@
 import google.generativeai as genai  # Googleの生成AIライブラリ
 import os
 import json
+import hashlib
 import re
+from pathlib import Path
 
 # APIキーの設定（環境変数から取得する方法）
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -15,63 +17,129 @@ config = genai.GenerationConfig(
     temperature=0,  # 出力のランダム性を制御
 )
 
+# マート一覧とプロンプトは起動時に1回だけ読み込む（対話ループの毎ターンでファイルを読まない）
+with open("meta_data.json", "r", encoding="utf-8") as f:
+    _MARTS = json.load(f)
+with open("prompts/mart_router_system_prompt.md", "r", encoding="utf-8") as f:
+    _ROUTER_PROMPT = f.read()
+with open("prompts/mart_edit_planner_system_prompt.md", "r", encoding="utf-8") as f:
+    _PLANNER_PROMPT = f.read()
+with open("prompts/mart_editor_system_prompt.md", "r", encoding="utf-8") as f:
+    _EDITOR_PROMPT = f.read()
+
+# JSON抽出用の正規表現（起動時に1回だけコンパイル）
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*')
+
+# 最初の { から対応する } までを1パスで探す（文字列リテラル内の括弧は数えない）
+def _find_json_object(s):
+    start = s.find('{')
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(s)):
+        ch = s[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
+
 # JSONを抽出する関数
 def extract_json(text):
     """レスポンスからJSON部分を抽出する"""
     # コードブロック（```json ... ```）を削除
-    text = re.sub(r'```json\s*', '', text)
-    text = re.sub(r'```\s*', '', text)
+    text = _JSON_FENCE_RE.sub('', text)
     text = text.strip()
     
     # JSONオブジェクトを探す（{ ... }）
-    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-    if json_match:
-        return json_match.group(0)
+    json_obj = _find_json_object(text)
+    if json_obj is not None:
+        return json_obj
+    return text
+
+# JSONを返すプロンプト用: ストリーミングで受け取り、JSONオブジェクトが閉じた時点で打ち切る
+def generate_json_text(model, prompt):
+    response = model.generate_content(prompt, generation_config=config, stream=True)
+    buf = []
+    for chunk in response:
+        try:
+            buf.append(chunk.text)
+        except ValueError:
+            # テキストを含まないチャンク（安全性フィルタ等）は読み飛ばす
+            continue
+        if _find_json_object("".join(buf)) is not None:
+            break
+    return "".join(buf)
+
+# temperature=0 の応答は同じプロンプトなら同じなので、プロンプトのハッシュでディスクにキャッシュする
+_CACHE_DIR = Path(".gemini_cache")
+
+def cached_generate(model, prompt, generate, require_json=False):
+    if config.temperature != 0:
+        return generate(model, prompt)
+
+    key = hashlib.sha256(f"{model.model_name}\n{prompt}".encode("utf-8")).hexdigest()
+    path = _CACHE_DIR / key
+    if path.exists():
+        return path.read_text(encoding="utf-8")
+
+    text = generate(model, prompt)
+    # 壊れた応答を保存すると同じ失敗を繰り返すので、JSONが取れたときだけ保存する
+    if text and (not require_json or _find_json_object(text) is not None):
+        _CACHE_DIR.mkdir(exist_ok=True)
+        path.write_text(text, encoding="utf-8")
     return text
 
+def generate_text(model, prompt):
+    response = model.generate_content(prompt, generation_config=config)
+    return response.text
+
 #　改修マート選択ルーター
 def mart_router(model, user_input):
-    # meta_data.jsonを読み込む
-    with open("meta_data.json", "r", encoding="utf-8") as f:
-        marts = json.load(f)
-    
-    system_prompt = open("prompts/mart_router_system_prompt.md", "r", encoding="utf-8").read()
-    
     # user_requestとmartsをJSON形式でプロンプトに含める
     user_prompt = json.dumps({
         "user_request": user_input,
-        "marts": marts
+        "marts": _MARTS
     }, ensure_ascii=False, indent=2)
     
-    prompt = system_prompt + "\n\n" + user_prompt
-    response = model.generate_content(prompt, generation_config=config)
-    return response.text
+    prompt = _ROUTER_PROMPT + "\n\n" + user_prompt
+    return cached_generate(model, prompt, generate_json_text, require_json=True)
 
 # 改修プランナー
 def mart_edit_planner(model, user_request, target_path, original_sql):
-    system_prompt = open("prompts/mart_edit_planner_system_prompt.md", "r").read()
     user_prompt = json.dumps({
         "user_request": user_request,
         "target_path": target_path,
         "original_sql": original_sql
     }, ensure_ascii=False)
-    prompt = system_prompt + "\n\n" + user_prompt
-    response = model.generate_content(prompt, generation_config=config)
-    return response.text
+    prompt = _PLANNER_PROMPT + "\n\n" + user_prompt
+    return cached_generate(model, prompt, generate_text)
 
 #　改修マートエディター
 def mart_editor(model, plan_md, target_path, original_sql):
-    system_prompt = open("prompts/mart_editor_system_prompt.md", "r").read()
     # JSON形式でplan_md、target_path、original_sqlを渡す
     user_prompt = json.dumps({
         "plan_md": plan_md,
         "target_path": target_path,
         "original_sql": original_sql
     }, ensure_ascii=False)
-    prompt = system_prompt + "\n\n" + user_prompt
+    prompt = _EDITOR_PROMPT + "\n\n" + user_prompt
     # MCPでgithubの過去の改修を参照とかすれば精度良くなるかも
-    response = model.generate_content(prompt, generation_config=config)
-    return response.text
+    return cached_generate(model, prompt, generate_json_text, require_json=True)
 
 
 session = {